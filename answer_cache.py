@@ -0,0 +1,44 @@
+import time
+from collections import OrderedDict
+from typing import Hashable, Optional, Tuple
+
+class AnswerCache:
+    """
+    Process-wide cache of serialized query responses.
+
+    Entries expire ttl_seconds after they are stored, and at most max_entries
+    are kept, evicting the least recently used ones first. Keys are built by
+    the caller and must identify everything the answer depends on.
+    """
+    def __init__(self, max_entries: int = 10_000, ttl_seconds: float = 600.0):
+        if max_entries <= 0:
+            raise ValueError("max_entries must be positive.")
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self._store: "OrderedDict[Hashable, Tuple[float, str]]" = OrderedDict()
+
+    def get(self, key: Hashable) -> Optional[str]:
+        """Returns the cached response for a key, or None if missing or expired."""
+        entry = self._store.get(key)
+        if entry is None:
+            return None
+        expires_at, response = entry
+        if expires_at <= time.monotonic():
+            del self._store[key]
+            return None
+        self._store.move_to_end(key)
+        return response
+
+    def set(self, key: Hashable, response: str):
+        """Stores a response for a key, evicting the oldest entries if full."""
+        self._store[key] = (time.monotonic() + self.ttl_seconds, response)
+        self._store.move_to_end(key)
+        while len(self._store) > self.max_entries:
+            self._store.popitem(last=False)
+
+    def __len__(self) -> int:
+        return len(self._store)
+
+    def clear(self):
+        """Removes all cached responses."""
+        self._store.clear()
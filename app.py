@@ -1,26 +1,31 @@
 """QA RAG application with multi-document user sessions."""
 import os
-import uuid
 import pathlib
+import tempfile
+import importlib.util
 import datetime
+import time
 import asyncio
-import threading
+import heapq
+import itertools
+import operator
 from contextlib import asynccontextmanager
-from typing import List, Optional, Dict, Any, Union
+from typing import List, Optional, Dict, Any, Union, Iterable, Tuple
 
 import json
 import socket
 import ipaddress
 from urllib.parse import urlparse
 from dotenv import load_dotenv
-from fastapi import FastAPI, UploadFile, File, HTTPException, Body, Request
-from fastapi.responses import RedirectResponse, StreamingResponse
+from fastapi import FastAPI, UploadFile, HTTPException, Request
+from fastapi.responses import RedirectResponse, StreamingResponse, Response
 from fastapi.middleware.cors import CORSMiddleware
-from pydantic import BaseModel, Field
+from pydantic import BaseModel
 from google import genai
 from google.genai import errors
 import uvicorn
 import httpx
+import faiss
 import numpy as np
 
 # Set Hugging Face Hub download timeout to 120 seconds to prevent ReadTimeoutErrors in Spaces
@@ -28,10 +33,15 @@ os.environ["HF_HUB_DOWNLOAD_TIMEOUT"] = "120"
 
 from sentence_transformers import SentenceTransformer
 from utils.loaders import load_source
-from utils.splitter import split_text
+from utils.splitter import split_text_iter
 from utils.exceptions import DocumentLoaderError
 from rag_session import RAGSession
 from user_session import UserSession
+from session_store import SessionStore
+from embedding_cache import EmbeddingCache
+from answer_cache import AnswerCache
+from document_cache import DocumentTextCache
+from query_batcher import QueryBatcher
 
 # Load environment variables
 load_dotenv()
@@ -39,49 +49,153 @@ load_dotenv()
 # --- Configuration ---
 SESSION_CLEANUP_INTERVAL_SECONDS = 300
 SESSION_TIMEOUT_MINUTES = 15
+SESSION_TIMEOUT_SECONDS = SESSION_TIMEOUT_MINUTES * 60
+# Maximum number of sessions held at once; beyond it the least recently
+# used ones are evicted before they time out. 0 means no limit.
+MAX_SESSIONS = int(os.getenv("MAX_SESSIONS", "0"))
+# Skips the periodic session cleanup task, e.g. under tests that drive
+# cleanup themselves.
+DISABLE_BACKGROUND_TASKS = os.getenv("DOCQA_DISABLE_BG_TASKS") == "1"
+# Number of chunks per embedding forward pass during ingestion.
+INGEST_EMBED_BATCH = int(os.getenv("INGEST_EMBED_BATCH", "128"))
+# Maximum number of chunk batches waiting to be embedded during ingestion.
+INGEST_QUEUE_BATCHES = 2
+# Size of the pieces an uploaded file is copied to disk in.
+UPLOAD_READ_CHUNK_BYTES = 1 << 20
+# Connection pool of the shared HTTP client used for URL ingests: total
+# connections, and idle keep-alive connections kept for reuse. Above httpx's
+# defaults of 100 and 20, so bursts of URL ingests are not capped by the pool.
+HTTP_MAX_CONNECTIONS = int(os.getenv("HTTP_MAX_CONNECTIONS", "200"))
+HTTP_MAX_KEEPALIVE_CONNECTIONS = int(os.getenv("HTTP_MAX_KEEPALIVE_CONNECTIONS", "50"))
+# Largest document accepted, whether uploaded or fetched from a URL.
+MAX_DOCUMENT_BYTES = int(os.getenv("MAX_DOCUMENT_BYTES", str(50 * 1024 * 1024)))
+# Maximum number of chunk embeddings kept in the process-wide cache.
+EMBEDDING_CACHE_SIZE = int(os.getenv("EMBEDDING_CACHE_SIZE", "50000"))
+# Maximum number of characters of extracted document text kept for
+# documents uploaded again.
+DOCUMENT_TEXT_CACHE_CHARS = int(os.getenv("DOCUMENT_TEXT_CACHE_CHARS", str(64 * 1024 * 1024)))
+# Plain-text formats are only decoded, which costs no more than hashing
+# them, so their text is not cached.
+PLAIN_TEXT_EXTENSIONS = {"md", "txt", "text"}
+# Maximum number of question embeddings kept for repeated questions.
+QUERY_EMBEDDING_CACHE_SIZE = 1024
+# Concurrent question embeddings are coalesced into forward passes of up to
+# this many questions, waiting at most this long for a batch to fill.
+QUERY_BATCH_SIZE = 32
+QUERY_BATCH_WAIT_SECONDS = 0.005
+# Maximum number of answers kept, and for how long, for repeated questions.
+ANSWER_CACHE_SIZE = 10_000
+ANSWER_CACHE_TTL_SECONDS = 600
+# Maximum number of documents searched concurrently by a single query.
+QUERY_CONCURRENCY = min(8, os.cpu_count() or 1)
+# OpenMP threads used by each FAISS call. Searches already run concurrently
+# in worker threads, one query vector each, so FAISS's own thread pool would
+# only oversubscribe the CPU; 0 keeps FAISS's default of one per core.
+FAISS_THREADS = int(os.getenv("FAISS_THREADS", "1"))
+
+EMBEDDING_MODEL_NAME = "paraphrase-multilingual-mpnet-base-v2"
+# "torch" runs the model in PyTorch; "onnx" runs an int8-quantized ONNX
+# export of it with ONNX Runtime on CPU; "static" swaps it for a model2vec
+# static-embedding model, which embeds by averaging token vectors.
+EMBEDDING_BACKEND = os.getenv("EMBEDDING_BACKEND", "torch").lower()
+EMBEDDING_STATIC_MODEL = os.getenv("EMBEDDING_STATIC_MODEL", "minishlab/potion-multilingual-128M")
+EMBEDDING_ONNX_FILE = os.getenv("EMBEDDING_ONNX_FILE", "onnx/model_qint8_avx512_vnni.onnx")
+# Weight and activation dtype of the torch backend: "float32", or the
+# half-precision "bfloat16" (CPUs with AVX-512 BF16/AMX, GPUs) or "float16"
+# (GPUs).
+EMBEDDING_PRECISION = os.getenv("EMBEDDING_PRECISION", "float32").lower()
+# Threads used by one embedding forward pass; 0 keeps the runtime's default.
+EMBEDDING_THREADS = int(os.getenv("EMBEDDING_THREADS", "0"))
 
 # --- In-Memory Session Storage ---
-sessions: Dict[str, UserSession] = {}
-_session_lock = threading.Lock()
+sessions = SessionStore(max_sessions=MAX_SESSIONS)
+
+# --- Embedding Model ---
+def load_embedding_model() -> SentenceTransformer:
+    """Loads the sentence embedding model for the configured backend."""
+    if EMBEDDING_BACKEND == "onnx":
+        model_kwargs = {"file_name": EMBEDDING_ONNX_FILE, "provider": "CPUExecutionProvider"}
+        if EMBEDDING_THREADS:
+            import onnxruntime
+            session_options = onnxruntime.SessionOptions()
+            session_options.intra_op_num_threads = EMBEDDING_THREADS
+            model_kwargs["session_options"] = session_options
+        return SentenceTransformer(EMBEDDING_MODEL_NAME, backend="onnx", model_kwargs=model_kwargs)
+    if EMBEDDING_BACKEND == "static":
+        # model2vec is an optional dependency, only needed by this backend.
+        if importlib.util.find_spec("model2vec") is None:
+            raise RuntimeError("The static embedding backend requires the model2vec package.")
+        from sentence_transformers.models import StaticEmbedding
+        return SentenceTransformer(modules=[StaticEmbedding.from_model2vec(EMBEDDING_STATIC_MODEL)])
+    if EMBEDDING_BACKEND != "torch":
+        raise RuntimeError(f"Unsupported EMBEDDING_BACKEND: {EMBEDDING_BACKEND}")
+    if EMBEDDING_PRECISION not in ("float32", "bfloat16", "float16"):
+        raise RuntimeError(f"Unsupported EMBEDDING_PRECISION: {EMBEDDING_PRECISION}")
+    import torch
+    if EMBEDDING_THREADS:
+        torch.set_num_threads(EMBEDDING_THREADS)
+    return SentenceTransformer(
+        EMBEDDING_MODEL_NAME,
+        model_kwargs={"torch_dtype": getattr(torch, EMBEDDING_PRECISION)},
+    )
 
 # --- Background Cleanup Logic ---
-def _clean_sessions_once():
-    now = datetime.datetime.now()
-    expiration_time = datetime.timedelta(minutes=SESSION_TIMEOUT_MINUTES)
-
-    with _session_lock:
-        # Create a copy of the session IDs to avoid modifying the dictionary while iterating
-        expired_ids = [
-            session_id for session_id, session in sessions.items()
-            if now - session.last_accessed > expiration_time
-        ]
-        for session_id in expired_ids:
-            del sessions[session_id]
+async def _clean_sessions_once():
+    cutoff = time.monotonic() - SESSION_TIMEOUT_SECONDS
+    for index in range(sessions.num_shards):
+        for session_id in sessions.remove_expired_from_shard(index, cutoff):
             print(f"Cleaned up expired user session: {session_id}")
+        # Shard locks are only held for one shard at a time; yield between
+        # shards so request handlers are not held up by a long sweep.
+        await asyncio.sleep(0)
 
 async def cleanup_expired_sessions_task():
     while True:
-        _clean_sessions_once()
+        await _clean_sessions_once()
         await asyncio.sleep(SESSION_CLEANUP_INTERVAL_SECONDS)
 
 # --- FastAPI Lifespan Management ---
 @asynccontextmanager
 async def lifespan(app: FastAPI):
-    print("Loading embedding model...")
-    app.state.embedding_model = SentenceTransformer('paraphrase-multilingual-mpnet-base-v2')
+    if FAISS_THREADS:
+        faiss.omp_set_num_threads(FAISS_THREADS)
+
+    print(f"Loading embedding model ({EMBEDDING_BACKEND} backend)...")
+    app.state.embedding_model = load_embedding_model()
+    app.state.embedding_cache = EmbeddingCache(max_entries=EMBEDDING_CACHE_SIZE)
+    app.state.query_embedding_cache = EmbeddingCache(max_entries=QUERY_EMBEDDING_CACHE_SIZE)
+    app.state.document_text_cache = DocumentTextCache(max_chars=DOCUMENT_TEXT_CACHE_CHARS)
+    app.state.answer_cache = AnswerCache(max_entries=ANSWER_CACHE_SIZE, ttl_seconds=ANSWER_CACHE_TTL_SECONDS)
+    app.state.query_batcher = QueryBatcher(
+        app.state.embedding_model,
+        max_batch_size=QUERY_BATCH_SIZE, max_wait_seconds=QUERY_BATCH_WAIT_SECONDS
+    )
     print("Embedding model loaded.")
 
     print("Initializing HTTP client...")
     headers = {
         "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36"
     }
-    app.state.http_client = httpx.AsyncClient(headers=headers)
+    # Keep-alive connections are pooled across URL ingests. HTTP/2 is used
+    # when the optional h2 package is installed.
+    app.state.http_client = httpx.AsyncClient(
+        headers=headers,
+        http2=importlib.util.find_spec("h2") is not None,
+        limits=httpx.Limits(
+            max_connections=HTTP_MAX_CONNECTIONS,
+            max_keepalive_connections=HTTP_MAX_KEEPALIVE_CONNECTIONS,
+        ),
+        timeout=httpx.Timeout(30.0, connect=5.0),
+    )
     print("HTTP client initialized.")
 
-    print("Starting session cleanup task...")
-    asyncio.create_task(cleanup_expired_sessions_task())
+    if not DISABLE_BACKGROUND_TASKS:
+        print("Starting session cleanup task...")
+        asyncio.create_task(cleanup_expired_sessions_task())
+    app.state.query_batcher.start()
     yield
 
+    await app.state.query_batcher.stop()
     print("Closing HTTP client...")
     await app.state.http_client.aclose()
     print("Application shutdown.")
@@ -122,11 +236,240 @@ def is_safe_url(url: str) -> bool:
     except Exception:
         return False
 
+# Streamed answer tokens are JSON string-escaped and wrapped in a pre-encoded
+# Server-Sent Events envelope instead of building and serializing a dict
+# per token.
+_SSE_TOKEN_PREFIX = b'data: {"token": '
+_SSE_EVENT_SUFFIX = b'}\n\n'
+
+def monotonic_to_isoformat(timestamp: float) -> str:
+    """Converts a time.monotonic() timestamp to an ISO 8601 local wall-clock time."""
+    elapsed = time.monotonic() - timestamp
+    return (datetime.datetime.now() - datetime.timedelta(seconds=elapsed)).isoformat()
+
+def new_id() -> str:
+    """Returns a random 128-bit identifier as 32 hex characters, like uuid4().hex."""
+    return os.urandom(16).hex()
+
+def sse_event(payload: Dict[str, Any]) -> bytes:
+    """Formats a JSON payload as a Server-Sent Events data frame."""
+    return f"data: {json.dumps(payload)}\n\n".encode()
+
+async def spool_upload(upload: UploadFile, suffix: str) -> pathlib.Path:
+    """
+    Writes an uploaded file to a named temporary file and returns its path.
+
+    Aborts with a 413 as soon as the upload exceeds MAX_DOCUMENT_BYTES.
+    """
+    if upload.size is not None and upload.size > MAX_DOCUMENT_BYTES:
+        raise HTTPException(status_code=413, detail="The uploaded document is too large.")
+
+    with tempfile.NamedTemporaryFile(suffix=suffix, delete=False) as tmp:
+        path = pathlib.Path(tmp.name)
+        try:
+            received = 0
+            while chunk := await upload.read(UPLOAD_READ_CHUNK_BYTES):
+                received += len(chunk)
+                if received > MAX_DOCUMENT_BYTES:
+                    raise HTTPException(status_code=413, detail="The uploaded document is too large.")
+                tmp.write(chunk)
+        except BaseException:
+            tmp.close()
+            path.unlink(missing_ok=True)
+            raise
+    return path
+
+async def fetch_to_file(url: str, suffix: str, follow_redirects: bool = False) -> pathlib.Path:
+    """
+    Downloads a URL into a named temporary file and returns its path.
+
+    The body is streamed to disk piece by piece and the download is aborted
+    with a 413 once it exceeds MAX_DOCUMENT_BYTES.
+    """
+    async with app.state.http_client.stream("GET", url, follow_redirects=follow_redirects) as response:
+        if response.is_error:
+            # Read the (small) error body so callers can report it.
+            await response.aread()
+        response.raise_for_status()
+        if int(response.headers.get("content-length") or 0) > MAX_DOCUMENT_BYTES:
+            raise HTTPException(status_code=413, detail="The document at this URL is too large.")
+
+        with tempfile.NamedTemporaryFile(suffix=suffix, delete=False) as tmp:
+            path = pathlib.Path(tmp.name)
+            try:
+                received = 0
+                async for chunk in response.aiter_bytes(UPLOAD_READ_CHUNK_BYTES):
+                    received += len(chunk)
+                    if received > MAX_DOCUMENT_BYTES:
+                        raise HTTPException(status_code=413, detail="The document at this URL is too large.")
+                    tmp.write(chunk)
+            except BaseException:
+                tmp.close()
+                path.unlink(missing_ok=True)
+                raise
+    return path
+
+def load_source_cached(path: pathlib.Path, ext: str) -> str:
+    """Runs load_source on a file, reusing the text of an identical file loaded before."""
+    if ext.lower().strip('.') in PLAIN_TEXT_EXTENSIONS:
+        return load_source(path, ext)
+    document_text_cache = app.state.document_text_cache
+    key = document_text_cache.key(path, ext)
+    text = document_text_cache.get(key)
+    if text is None:
+        text = load_source(path, ext)
+        document_text_cache.set(key, text)
+    return text
+
+async def embed_query(query: str) -> np.ndarray:
+    """
+    Embeds a query as an L2-normalized float32 vector, reusing recent results.
+
+    Cache misses go through the query batcher, so concurrent questions share
+    embedding forward passes.
+    """
+    query_embedding_cache = app.state.query_embedding_cache
+    cached_embedding = query_embedding_cache.get(query)
+    if cached_embedding is not None:
+        return cached_embedding
+
+    try:
+        query_embedding = await asyncio.wait_for(
+            app.state.query_batcher.embed(query), timeout=30.0
+        )
+    except asyncio.TimeoutError:
+        raise TimeoutError("Embedding generation for query timed out.")
+    query_embedding_cache.update({query: query_embedding})
+    return query_embedding
+
+async def embed_batch(chunks: List[str]) -> np.ndarray:
+    """
+    Embeds a batch of text chunks, returning one row per chunk.
+
+    The process-wide cache is checked for existing chunk embeddings first.
+    Only chunks that have not been seen before, in any session, are sent to
+    the embedding model, avoiding redundant, expensive computations.
+    """
+    embedding_cache = app.state.embedding_cache
+
+    # Rows are written straight into one preallocated matrix: cache hits
+    # first, then the newly encoded chunks after encoding.
+    dim = app.state.embedding_model.get_sentence_embedding_dimension()
+    embeddings = np.empty((len(chunks), dim), dtype=np.float32)
+
+    # Probe the cache for every chunk at once.
+    indices_of_new_chunks = []
+    for i, hit in enumerate(embedding_cache.get_many(chunks)):
+        if hit is None:
+            indices_of_new_chunks.append(i)
+        else:
+            embeddings[i] = hit
+
+    # If there are new chunks, encode them in a single batch for efficiency
+    if indices_of_new_chunks:
+        chunks_to_encode = [chunks[i] for i in indices_of_new_chunks]
+        # Encode each unique new chunk only once to save computation
+        unique_positions = {}
+        dedup_map = [unique_positions.setdefault(chunk, len(unique_positions)) for chunk in chunks_to_encode]
+        unique_new_chunks = list(unique_positions)
+
+        try:
+            generated_embeddings = await asyncio.wait_for(
+                asyncio.to_thread(
+                    app.state.embedding_model.encode, unique_new_chunks,
+                    convert_to_numpy=True, batch_size=INGEST_EMBED_BATCH,
+                    normalize_embeddings=True, show_progress_bar=False
+                ),
+                timeout=180.0
+            )
+        except asyncio.TimeoutError:
+            raise HTTPException(status_code=504, detail="Embedding generation timed out.")
+        except Exception as e:
+            raise HTTPException(status_code=500, detail=f"Embedding generation failed: {e}")
+
+        # Add the newly generated embeddings to the cache for future use
+        embedding_cache.update(dict(zip(unique_new_chunks, generated_embeddings)))
+
+        embeddings[indices_of_new_chunks] = generated_embeddings[dedup_map]
+
+    return embeddings
+
+async def embed_and_ingest(chunks: Iterable[str], rag_session: RAGSession):
+    """
+    Embeds chunks and adds them to a document's index as a pipeline.
+
+    A producer task groups chunks into batches of INGEST_EMBED_BATCH and puts
+    them on a bounded queue, while this coroutine embeds each batch and adds
+    it to the index as soon as it is ready. At most INGEST_QUEUE_BATCHES
+    batches wait in memory at a time.
+    """
+    queue: asyncio.Queue = asyncio.Queue(maxsize=INGEST_QUEUE_BATCHES)
+    chunk_iter = iter(chunks)
+
+    def next_batch() -> List[str]:
+        return list(itertools.islice(chunk_iter, INGEST_EMBED_BATCH))
+
+    async def produce():
+        try:
+            # Splitting is CPU-bound, so each batch is cut in a worker thread.
+            while batch := await asyncio.to_thread(next_batch):
+                await queue.put(batch)
+        except asyncio.CancelledError:
+            # The consumer has stopped reading, so no end marker is needed,
+            # and putting one on a full queue would never return.
+            raise
+        except Exception:
+            await queue.put(None)
+            raise
+        await queue.put(None)
+
+    producer = asyncio.create_task(produce())
+    try:
+        while (batch := await queue.get()) is not None:
+            embeddings = await embed_batch(batch)
+            # Quantizing and indexing the batch also runs off the event loop;
+            # the document is not visible to queries until it is added to the
+            # user session.
+            await asyncio.to_thread(rag_session.ingest, batch, embeddings)
+        # Propagate any error raised while splitting.
+        await producer
+        rag_session.shrink_to_fit()
+        print(f"Session ingested {len(rag_session.chunks)} chunks.")
+    finally:
+        producer.cancel()
+
+# Non-streaming generations in flight, keyed by (model, prompt). Concurrent
+# requests with an identical prompt await the same Gemini call instead of
+# each making their own.
+_inflight_generations: Dict[Tuple[str, str], asyncio.Future] = {}
+
+async def generate_content_coalesced(model: str, prompt: str):
+    """Calls Gemini's generate_content, sharing the call with identical in-flight requests."""
+    key = (model, prompt)
+    future = _inflight_generations.get(key)
+    if future is None:
+        future = asyncio.ensure_future(asyncio.wait_for(
+            ai_client.aio.models.generate_content(model=model, contents=prompt),
+            timeout=30.0
+        ))
+        _inflight_generations[key] = future
+
+        def forget(done: asyncio.Future):
+            _inflight_generations.pop(key, None)
+            # Mark the error as retrieved even if every waiter was cancelled.
+            if not done.cancelled():
+                done.exception()
+
+        future.add_done_callback(forget)
+    # Shielded so a client disconnecting does not cancel the call for the
+    # other requests waiting on it.
+    return await asyncio.shield(future)
+
 async def generate_rag_response(query: str, context_chunks: List[str], stream: bool = False):
     """Generates a response from the LLM, supports streaming."""
     if not context_chunks:
         if stream:
-            yield f"data: {json.dumps({'token': 'No relevant information found.'})}\n\n"
+            yield sse_event({'token': 'No relevant information found.'})
         else:
             yield "No relevant information found."
         return
@@ -158,16 +501,10 @@ async def generate_rag_response(query: str, context_chunks: List[str], stream: b
                 async for chunk in response:
                     # Ensure the chunk has content before sending
                     if chunk.text:
-                        yield f"data: {json.dumps({'token': chunk.text})}\n\n"
+                        yield _SSE_TOKEN_PREFIX + json.dumps(chunk.text).encode() + _SSE_EVENT_SUFFIX
                 return  # Exit generator on success
             else:
-                response = await asyncio.wait_for(
-                    ai_client.aio.models.generate_content(
-                        model=current_model,
-                        contents=prompt
-                    ),
-                    timeout=30.0
-                )
+                response = await generate_content_coalesced(current_model, prompt)
                 yield response.text.strip()
                 return  # Exit generator on success
         except errors.APIError as e:
@@ -176,7 +513,7 @@ async def generate_rag_response(query: str, context_chunks: List[str], stream: b
                 if attempt == max_retries - 1:
                     error_message = "Model is experiencing high demand. Please try again later."
                     if stream:
-                        yield f"data: {json.dumps({'error': error_message})}\n\n"
+                        yield sse_event({'error': error_message})
                         return
                     else:
                         raise HTTPException(status_code=503, detail=error_message)
@@ -187,21 +524,21 @@ async def generate_rag_response(query: str, context_chunks: List[str], stream: b
             else:
                 error_message = f"LLM generation failed: {e.message}"
                 if stream:
-                    yield f"data: {json.dumps({'error': error_message})}\n\n"
+                    yield sse_event({'error': error_message})
                     return
                 else:
                     raise HTTPException(status_code=500, detail=error_message)
         except asyncio.TimeoutError:
             error_message = "LLM generation timed out."
             if stream:
-                yield f"data: {json.dumps({'error': error_message})}\n\n"
+                yield sse_event({'error': error_message})
                 return
             else:
                 raise HTTPException(status_code=504, detail=error_message)
         except Exception as e:
             error_message = f"LLM generation failed: {e}"
             if stream:
-                yield f"data: {json.dumps({'error': error_message})}\n\n"
+                yield sse_event({'error': error_message})
                 return
             else:
                 raise HTTPException(status_code=500, detail=error_message)
@@ -248,46 +585,44 @@ async def root():
 
 @app.post("/sessions", response_model=SessionResponse, summary="Create a new user session")
 async def create_session():
-    session_id = uuid.uuid4().hex
-    with _session_lock:
-        sessions[session_id] = UserSession()
+    session_id = new_id()
+    sessions[session_id] = UserSession()
     return SessionResponse(session_id=session_id)
 
 @app.post("/sessions/{session_id}/ingest", response_model=IngestResponse, summary="Ingest a document into a session")
 async def ingest(session_id: str, request: Request):
-    with _session_lock:
-        user_session = sessions.get(session_id)
+    user_session = sessions.get(session_id)
     if not user_session:
         raise HTTPException(status_code=404, detail="User session not found.")
 
     file_filename = None
-    file_content = None
+    upload = None
     url = None
     has_file = False
 
-    body_bytes = await request.body()
-
-    # 1. Try to parse as JSON URL first
-    try:
-        body = json.loads(body_bytes)
-        url = body.get("url")
-    except Exception:
-        pass
+    content_type = request.headers.get("content-type", "")
 
-    # 2. If no URL was successfully parsed, try parsing as Form data
-    if not url:
+    if content_type.startswith(("multipart/form-data", "application/x-www-form-urlencoded")):
+        # 1. Parse form data. Starlette streams the upload into a spooled
+        # temporary file, so the raw request body is never buffered whole.
         try:
             form = await request.form()
             file = form.get("file")
             if file and hasattr(file, "filename") and file.filename:
                 file_filename = file.filename
-                file_content = await file.read()
+                upload = file
                 has_file = True
         except Exception:
             pass
+    else:
+        # 2. Otherwise, parse the body as JSON with a URL.
+        try:
+            body = json.loads(await request.body())
+            url = body.get("url")
+        except Exception:
+            pass
 
     if not has_file and not url:
-        content_type = request.headers.get("content-type", "")
         headers_str = str(dict(request.headers))
         try:
             body_preview = (await request.body())[:200]
@@ -306,13 +641,17 @@ async def ingest(session_id: str, request: Request):
         raise HTTPException(status_code=400, detail="Provide either a file or a URL, not both.")
 
     source_name = ""
-    content = b""
+    content: Union[bytes, pathlib.Path] = b""
     source_ext = "url"
+    tmp_path = None
 
     if has_file:
         source_name = file_filename
-        content = file_content
         source_ext = pathlib.Path(source_name).suffix or "url"
+        # Copy the upload to a file on disk in fixed-size pieces and let the
+        # loader read it from there, so it is never held in memory whole.
+        tmp_path = await spool_upload(upload, source_ext)
+        content = tmp_path
     elif url:
         if not is_safe_url(url):
             raise HTTPException(status_code=400, detail="Invalid or restricted URL provided.")
@@ -320,128 +659,124 @@ async def ingest(session_id: str, request: Request):
         try:
             jina_url = f"https://r.jina.ai/{url}"
             print(f"Fetching URL via Jina Reader: {jina_url}")
-            response = await app.state.http_client.get(jina_url, timeout=30.0)
-            response.raise_for_status()
-            content = response.content
-            source_ext = "md"  # Jina Reader returns Markdown content
+            # Jina Reader returns Markdown content
+            tmp_path = await fetch_to_file(jina_url, ".md", follow_redirects=True)
+            source_ext = "md"
+        except HTTPException:
+            raise
         except Exception as e:
             print(f"Jina Reader fetch failed: {e}. Falling back to direct URL fetch...")
             try:
-                response = await app.state.http_client.get(url, timeout=30.0)
-                response.raise_for_status()
-                content = response.content
-                from urllib.parse import urlparse
                 parsed_url = urlparse(url)
                 source_ext = pathlib.Path(parsed_url.path).suffix or "url"
+                # Redirects are not followed here, since is_safe_url only
+                # vetted the original host.
+                tmp_path = await fetch_to_file(url, source_ext)
             except httpx.HTTPStatusError as e_direct:
                 raise HTTPException(status_code=e_direct.response.status_code, detail=f"Failed to fetch URL: {e_direct.response.text}")
             except httpx.RequestError as e_direct:
                 raise HTTPException(status_code=500, detail=f"Failed to fetch URL: {e_direct}")
+        content = tmp_path
 
     try:
-        text = load_source(content, source_ext)
+        # Parsing documents is CPU-bound and can take seconds for large files.
+        text = await asyncio.to_thread(load_source_cached, content, source_ext)
     except DocumentLoaderError as e:
         raise HTTPException(status_code=400, detail=str(e))
+    finally:
+        if tmp_path is not None:
+            tmp_path.unlink(missing_ok=True)
 
     if not text or not text.strip():
         raise HTTPException(status_code=400, detail="Could not extract any text from the provided source.")
 
-    chunks = split_text(text)
-    if not chunks:
-        raise HTTPException(status_code=400, detail="The document is too short to be processed.")
-
-    # --- Caching and Embedding Logic ---
-    # This logic checks the user's session cache for existing chunk embeddings.
-    # It only sends chunks that have not been seen before to the embedding model,
-    # avoiding redundant, expensive computations.
-    ordered_embeddings = [None] * len(chunks)
-    chunks_to_encode = []
-    indices_of_new_chunks = []
-
-    # Identify which chunks are new and which are cached
-    for i, chunk in enumerate(chunks):
-        if chunk in user_session.embedding_cache:
-            ordered_embeddings[i] = user_session.embedding_cache[chunk]
-        else:
-            chunks_to_encode.append(chunk)
-            indices_of_new_chunks.append(i)
-
-    # If there are new chunks, encode them in a single batch for efficiency
-    if chunks_to_encode:
-        # Encode each unique new chunk only once to save computation
-        unique_new_chunks = list(dict.fromkeys(chunks_to_encode))
-
-        try:
-            generated_embeddings = await asyncio.wait_for(
-                asyncio.to_thread(
-                    app.state.embedding_model.encode, unique_new_chunks, convert_to_numpy=True
-                ),
-                timeout=180.0
-            )
-        except asyncio.TimeoutError:
-            raise HTTPException(status_code=504, detail="Embedding generation timed out.")
-        except Exception as e:
-            raise HTTPException(status_code=500, detail=f"Embedding generation failed: {e}")
-
-        new_embeddings_dict = {
-            chunk: emb for chunk, emb in zip(unique_new_chunks, generated_embeddings)
-        }
-
-        # Add the newly generated embeddings to the session cache for future use
-        user_session.embedding_cache.update(new_embeddings_dict)
-
-        # Place the new embeddings into the final ordered list
-        for i, chunk in enumerate(chunks_to_encode):
-            original_index = indices_of_new_chunks[i]
-            ordered_embeddings[original_index] = new_embeddings_dict[chunk]
-
-    all_embeddings_np = np.array(ordered_embeddings)
-    # --- End of Caching and Embedding Logic ---
-
-    doc_id = uuid.uuid4().hex
+    # Chunks are split lazily and embedded batch by batch, so the document's
+    # index is built incrementally and splitting overlaps with embedding.
+    doc_id = new_id()
     rag_session = RAGSession(source=source_name, embedding_model=app.state.embedding_model)
-    # Pass the pre-computed embeddings to the new ingest method
-    rag_session.ingest(chunks, all_embeddings_np)
+    await embed_and_ingest(split_text_iter(text), rag_session)
+    if not rag_session.chunks:
+        raise HTTPException(status_code=400, detail="The document is too short to be processed.")
     user_session.add_doc(doc_id, rag_session)
 
-    return IngestResponse(doc_id=doc_id, source=source_name, num_chunks=len(chunks))
+    return IngestResponse(doc_id=doc_id, source=source_name, num_chunks=len(rag_session.chunks))
 
-@app.post("/sessions/{session_id}/query", summary="Ask a question within a session")
+@app.post("/sessions/{session_id}/query", response_model=QueryResponse, summary="Ask a question within a session")
 async def query(session_id: str, payload: QueryPayload):
-    with _session_lock:
-        user_session = sessions.get(session_id)
+    user_session = sessions.get(session_id)
     if not user_session:
         raise HTTPException(status_code=404, detail="User session not found.")
 
     user_session.touch()
 
-    # Determine which documents to query.
-    docs_to_query_items = user_session.docs.items()
     if payload.doc_ids:
+        # Query only the requested subset of documents.
         docs_to_query_items = [
-            (doc_id, user_session.get_doc(doc_id))
+            (doc_id, rag_session)
             for doc_id in payload.doc_ids
-            if user_session.get_doc(doc_id) is not None
+            if (rag_session := user_session.get_doc(doc_id)) is not None
         ]
+        queried_doc_ids = tuple(sorted(doc_id for doc_id, _ in docs_to_query_items))
+    else:
+        queried_doc_ids = tuple(user_session.docs)
+
+    # Documents never change after ingestion, so an answer stays valid for as
+    # long as the same documents are queried with the same question.
+    answer_key = None
+    if not payload.stream:
+        answer_key = (session_id, queried_doc_ids, payload.q.strip().lower())
+        cached_answer = app.state.answer_cache.get(answer_key)
+        if cached_answer is not None:
+            return Response(content=cached_answer, media_type="application/json")
+
+    if payload.doc_ids:
+        # Documents are searched concurrently; each search runs its CPU-bound
+        # work in a worker thread, bounded by the semaphore.
+        semaphore = asyncio.Semaphore(QUERY_CONCURRENCY)
+
+        async def query_doc(doc_id: str, rag_session: RAGSession) -> List[Dict[str, Any]]:
+            async with semaphore:
+                retrieved = await rag_session.query_with_embedding(query_embedding, k=5)
+            for chunk in retrieved:
+                chunk['doc_id'] = doc_id
+                chunk['source'] = rag_session.source
+            return retrieved
 
-    all_chunks = []
-    for doc_id, rag_session in docs_to_query_items:
         try:
-            retrieved = await rag_session.query(payload.q, k=5)
+            # The question is embedded once and shared by every document.
+            query_embedding = await embed_query(payload.q) if docs_to_query_items else None
+            results = await asyncio.gather(
+                *(query_doc(doc_id, rag_session) for doc_id, rag_session in docs_to_query_items)
+            )
         except TimeoutError as e:
             raise HTTPException(status_code=504, detail=str(e))
         except Exception as e:
             raise HTTPException(status_code=500, detail=f"Query search failed: {e}")
 
-        for chunk in retrieved:
-            chunk['doc_id'] = doc_id
-            chunk['source'] = rag_session.source
-        all_chunks.extend(retrieved)
-
-    all_chunks.sort(key=lambda x: x['score'], reverse=True)
-    top_chunks = all_chunks[:5]
+        top_chunks = heapq.nlargest(
+            5, itertools.chain.from_iterable(results), key=operator.itemgetter('score')
+        )
+    elif not user_session.docs:
+        # Nothing to search, so skip embedding the question; the answer
+        # step returns its canned reply without calling the LLM.
+        top_chunks = []
+    else:
+        # Query all documents: embed the question once and run a single
+        # search over the session-wide index.
+        try:
+            query_embedding = await embed_query(payload.q)
+            top_chunks = await asyncio.wait_for(
+                asyncio.to_thread(user_session.search, query_embedding, 5),
+                timeout=30.0
+            )
+        except (asyncio.TimeoutError, TimeoutError) as e:
+            raise HTTPException(status_code=504, detail=str(e) or "Query search timed out.")
+        except Exception as e:
+            raise HTTPException(status_code=500, detail=f"Query search failed: {e}")
 
-    relevant_sources = [QuerySource(**chunk) for chunk in top_chunks]
+    # The chunks are built by the search code with exactly these fields, so
+    # skip re-validating them.
+    relevant_sources = [QuerySource.model_construct(**chunk) for chunk in top_chunks]
     relevant_texts = [chunk['text'] for chunk in top_chunks]
 
     # If streaming is requested, return a StreamingResponse
@@ -449,14 +784,14 @@ async def query(session_id: str, payload: QueryPayload):
         async def stream_generator():
             # First, send an event with the sources
             sources_data = [s.model_dump() for s in relevant_sources]
-            yield f"data: {json.dumps({'type': 'sources', 'data': sources_data})}\n\n"
+            yield sse_event({'type': 'sources', 'data': sources_data})
 
             # Then, stream the LLM response tokens
             async for chunk in generate_rag_response(payload.q, relevant_texts, stream=True):
                 yield chunk
 
             # Signal the end of the stream
-            yield f"data: {json.dumps({'type': 'end'})}\n\n"
+            yield sse_event({'type': 'end'})
 
         return StreamingResponse(
             stream_generator(),
@@ -474,46 +809,45 @@ async def query(session_id: str, payload: QueryPayload):
         # The async generator yields one result in non-streaming mode
         async for content in generate_rag_response(payload.q, relevant_texts, stream=False):
             answer = content
-        return QueryResponse(answer=answer, sources=relevant_sources)
+        # Serialize with pydantic-core directly instead of letting FastAPI
+        # re-validate and re-encode the response model field by field.
+        response = QueryResponse.model_construct(answer=answer, sources=relevant_sources)
+        response_json = response.model_dump_json()
+        app.state.answer_cache.set(answer_key, response_json)
+        return Response(content=response_json, media_type="application/json")
 
 @app.get("/sessions/{session_id}/status", response_model=SessionStatusResponse, summary="Get session status and remaining time")
 async def get_session_status(session_id: str):
     """Returns session status, activity state, and remaining time before expiration."""
-    now = datetime.datetime.now()
-    expiration_time = datetime.timedelta(minutes=SESSION_TIMEOUT_MINUTES)
-    
-    with _session_lock:
-        user_session = sessions.get(session_id)
+    user_session = sessions.get(session_id)
     
     if not user_session:
         return SessionStatusResponse(
             session_id=session_id,
             active=False,
-            last_accessed=now.isoformat()
+            last_accessed=datetime.datetime.now().isoformat()
         )
     
-    time_since_access = now - user_session.last_accessed
-    remaining_time = expiration_time - time_since_access
+    remaining_seconds = SESSION_TIMEOUT_SECONDS - (time.monotonic() - user_session.last_accessed)
     
-    if remaining_time.total_seconds() <= 0:
+    if remaining_seconds <= 0:
         return SessionStatusResponse(
             session_id=session_id,
             active=False,
-            last_accessed=user_session.last_accessed.isoformat()
+            last_accessed=monotonic_to_isoformat(user_session.last_accessed)
         )
     
     return SessionStatusResponse(
         session_id=session_id,
         active=True,
-        remaining_minutes=remaining_time.total_seconds() / 60,
-        last_accessed=user_session.last_accessed.isoformat()
+        remaining_minutes=remaining_seconds / 60,
+        last_accessed=monotonic_to_isoformat(user_session.last_accessed)
     )
 
 @app.post("/sessions/{session_id}/refresh", response_model=SessionRefreshResponse, summary="Refresh session to extend timeout")
 async def refresh_session(session_id: str):
     """Refreshes a session to extend its timeout period."""
-    with _session_lock:
-        user_session = sessions.get(session_id)
+    user_session = sessions.get(session_id)
     
     if not user_session:
         raise HTTPException(status_code=404, detail="User session not found.")
@@ -522,24 +856,19 @@ async def refresh_session(session_id: str):
     
     return SessionRefreshResponse(
         session_id=session_id,
-        refreshed_at=user_session.last_accessed.isoformat(),
+        refreshed_at=monotonic_to_isoformat(user_session.last_accessed),
         remaining_minutes=SESSION_TIMEOUT_MINUTES
     )
 
 @app.get("/sessions/{session_id}/health", summary="Simple session health check")
 async def session_health_check(session_id: str):
     """Simple endpoint to check if session exists and is active."""
-    now = datetime.datetime.now()
-    expiration_time = datetime.timedelta(minutes=SESSION_TIMEOUT_MINUTES)
-    
-    with _session_lock:
-        user_session = sessions.get(session_id)
+    user_session = sessions.get(session_id)
     
     if not user_session:
         raise HTTPException(status_code=404, detail="Session not found")
     
-    time_since_access = now - user_session.last_accessed
-    if time_since_access > expiration_time:
+    if time.monotonic() - user_session.last_accessed > SESSION_TIMEOUT_SECONDS:
         raise HTTPException(status_code=410, detail="Session expired")
     
     return {"status": "active"}
@@ -547,8 +876,7 @@ async def session_health_check(session_id: str):
 @app.delete("/sessions/{session_id}/documents/{doc_id}", status_code=204, summary="Delete a document from a session")
 async def delete_document(session_id: str, doc_id: str):
     """Deletes a specific document from a user session."""
-    with _session_lock:
-        user_session = sessions.get(session_id)
+    user_session = sessions.get(session_id)
     if not user_session:
         raise HTTPException(status_code=404, detail="User session not found.")
 
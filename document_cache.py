@@ -0,0 +1,63 @@
+import hashlib
+import pathlib
+import threading
+from collections import OrderedDict
+from typing import Optional, Tuple
+
+class DocumentTextCache:
+    """
+    Process-wide cache of the text extracted from ingested documents.
+
+    Entries are keyed by the file type and a BLAKE2b digest of the file's
+    bytes, so a document uploaded again, in any session, is not parsed a
+    second time. The cache holds at most max_chars characters of text in
+    total and evicts the least recently used documents first. Documents are
+    parsed in worker threads, so access is guarded by a lock.
+    """
+    def __init__(self, max_chars: int = 64 * 1024 * 1024):
+        if max_chars <= 0:
+            raise ValueError("max_chars must be positive.")
+        self.max_chars = max_chars
+        self._chars = 0
+        self._store: "OrderedDict[Tuple[str, bytes], str]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def key(path: pathlib.Path, ext: str, read_size: int = 1 << 20) -> Tuple[str, bytes]:
+        """Returns the cache key of a file: its normalized extension and content hash."""
+        digest = hashlib.blake2b(digest_size=16)
+        with open(path, "rb") as f:
+            while chunk := f.read(read_size):
+                digest.update(chunk)
+        return ext.lower().strip('.'), digest.digest()
+
+    def get(self, key: Tuple[str, bytes]) -> Optional[str]:
+        """Returns the cached text for a key, or None if not cached."""
+        with self._lock:
+            text = self._store.get(key)
+            if text is not None:
+                self._store.move_to_end(key)
+            return text
+
+    def set(self, key: Tuple[str, bytes], text: str):
+        """Stores the text of a document, evicting the oldest entries if full."""
+        if len(text) > self.max_chars:
+            return
+        with self._lock:
+            previous = self._store.pop(key, None)
+            if previous is not None:
+                self._chars -= len(previous)
+            self._store[key] = text
+            self._chars += len(text)
+            while self._chars > self.max_chars:
+                _, evicted = self._store.popitem(last=False)
+                self._chars -= len(evicted)
+
+    def __len__(self) -> int:
+        return len(self._store)
+
+    def clear(self):
+        """Removes all cached text."""
+        with self._lock:
+            self._store.clear()
+            self._chars = 0
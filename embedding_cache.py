@@ -0,0 +1,58 @@
+import hashlib
+from collections import OrderedDict
+from typing import Dict, List, Optional
+import numpy as np
+
+class EmbeddingCache:
+    """
+    Process-wide cache of text chunk embeddings, shared by all user sessions.
+
+    Entries are keyed by a BLAKE2b digest of the chunk text rather than the
+    text itself, so identical content ingested in any session is embedded
+    only once and the memory held by keys does not grow with chunk length.
+    The cache holds at most max_entries embeddings and evicts the least
+    recently used ones first.
+    """
+    def __init__(self, max_entries: int = 50_000):
+        if max_entries <= 0:
+            raise ValueError("max_entries must be positive.")
+        self.max_entries = max_entries
+        self._store: "OrderedDict[bytes, np.ndarray]" = OrderedDict()
+
+    @staticmethod
+    def key(text: str) -> bytes:
+        """Returns the content-hash key for a chunk of text."""
+        return hashlib.blake2b(text.encode("utf-8"), digest_size=16).digest()
+
+    def get(self, text: str) -> Optional[np.ndarray]:
+        """Returns the cached embedding for a chunk, or None if not cached."""
+        return self.get_many([text])[0]
+
+    def get_many(self, texts: List[str]) -> List[Optional[np.ndarray]]:
+        """Returns the cached embedding, or None, for each chunk in order."""
+        keys = list(map(self.key, texts))
+        hits = list(map(self._store.get, keys))
+        move_to_end = self._store.move_to_end
+        for k, hit in zip(keys, hits):
+            if hit is not None:
+                move_to_end(k)
+        return hits
+
+    def update(self, embeddings: Dict[str, np.ndarray]):
+        """Adds a mapping of chunk text to embedding to the cache."""
+        for text, embedding in embeddings.items():
+            k = self.key(text)
+            self._store[k] = embedding
+            self._store.move_to_end(k)
+        while len(self._store) > self.max_entries:
+            self._store.popitem(last=False)
+
+    def __contains__(self, text: str) -> bool:
+        return self.key(text) in self._store
+
+    def __len__(self) -> int:
+        return len(self._store)
+
+    def clear(self):
+        """Removes all cached embeddings."""
+        self._store.clear()
@@ -0,0 +1,74 @@
+import asyncio
+from typing import List, Optional, Tuple
+import numpy as np
+
+class QueryBatcher:
+    """
+    Coalesces concurrent single-text embedding requests into batched
+    forward passes.
+
+    Callers await `embed(text)`. A background task takes the first queued
+    text, waits up to max_wait_seconds for more to arrive, and encodes up to
+    max_batch_size texts with one call to the model, so simultaneous queries
+    share a forward pass instead of each paying for their own.
+    """
+    def __init__(self, embedding_model, max_batch_size: int = 32, max_wait_seconds: float = 0.005):
+        self.embedding_model = embedding_model
+        self.max_batch_size = max_batch_size
+        self.max_wait_seconds = max_wait_seconds
+        self._queue: asyncio.Queue = asyncio.Queue()
+        self._worker: Optional[asyncio.Task] = None
+
+    def start(self):
+        """Starts the background batching task on the running event loop."""
+        if self._worker is None:
+            self._worker = asyncio.create_task(self._run())
+
+    async def stop(self):
+        """Stops the batching task and fails any requests still queued."""
+        if self._worker is not None:
+            self._worker.cancel()
+            try:
+                await self._worker
+            except asyncio.CancelledError:
+                pass
+            self._worker = None
+        while not self._queue.empty():
+            _, future = self._queue.get_nowait()
+            if not future.done():
+                future.set_exception(RuntimeError("Query batcher stopped."))
+
+    async def embed(self, text: str) -> np.ndarray:
+        """Returns the L2-normalized float32 embedding of a text."""
+        future = asyncio.get_running_loop().create_future()
+        await self._queue.put((text, future))
+        return await future
+
+    async def _run(self):
+        while True:
+            batch = [await self._queue.get()]
+            if self.max_wait_seconds > 0:
+                await asyncio.sleep(self.max_wait_seconds)
+            while len(batch) < self.max_batch_size and not self._queue.empty():
+                batch.append(self._queue.get_nowait())
+            await self._encode(batch)
+
+    async def _encode(self, batch: List[Tuple[str, asyncio.Future]]):
+        # Requests whose caller gave up (e.g. timed out) are skipped.
+        batch = [(text, future) for text, future in batch if not future.done()]
+        if not batch:
+            return
+        try:
+            embeddings = await asyncio.to_thread(
+                self.embedding_model.encode, [text for text, _ in batch],
+                convert_to_numpy=True, normalize_embeddings=True,
+                batch_size=len(batch), show_progress_bar=False
+            )
+        except Exception as e:
+            for _, future in batch:
+                if not future.done():
+                    future.set_exception(e)
+            return
+        for (_, future), embedding in zip(batch, embeddings):
+            if not future.done():
+                future.set_result(np.asarray(embedding, dtype='float32'))
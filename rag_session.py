@@ -1,7 +1,81 @@
+import operator
+from array import array
+from typing import Iterable, Iterator
 import faiss
 import numpy as np
-from sentence_transformers import SentenceTransformer
-import datetime
+import time
+
+# Number of candidates taken from the binary (Hamming) first pass and
+# re-scored against the int8-quantized embeddings.
+RESCORE_CANDIDATES = 100
+
+# Documents with more chunks than this switch from an exhaustive Hamming scan
+# to an HNSW graph over the binary codes, which is searched in sub-linear time.
+HNSW_MIN_CHUNKS = 50_000
+HNSW_NEIGHBORS = 32
+
+def binarize(embeddings: np.ndarray) -> np.ndarray:
+    """Packs embeddings into binary codes holding the sign of each dimension."""
+    return np.packbits(embeddings > 0, axis=-1)
+
+def top_k_indices(scores: np.ndarray, k: int) -> np.ndarray:
+    """Returns the indices of the k highest scores, best first."""
+    if k < len(scores):
+        # Partial selection is O(N); only the k winners are sorted.
+        top = np.argpartition(-scores, k)[:k]
+        return top[np.argsort(-scores[top])]
+    return np.argsort(-scores)
+
+def quantize_int8(embeddings: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+    """
+    Scalar-quantizes embeddings to int8 with one float32 scale per row.
+
+    Each row is scaled so its largest component maps to +/-127, so no
+    calibration data is needed and rows can be quantized as they arrive.
+    A row is approximately codes[i] * scales[i].
+    """
+    scales = np.abs(embeddings).max(axis=1) / 127.0
+    scales[scales == 0] = 1.0
+    codes = np.rint(embeddings / scales[:, None]).astype(np.int8)
+    return codes, scales.astype('float32')
+
+class ChunkStore:
+    """
+    Append-only sequence of text chunks kept in a single UTF-8 buffer.
+
+    Chunks are stored back to back with an offset table instead of as one
+    Python string each, which saves the per-object overhead and keeps the
+    text of a document in one allocation. A chunk is decoded only when it is
+    read, i.e. for the few results a search returns.
+    """
+    __slots__ = ("_blob", "_offsets")
+
+    def __init__(self):
+        self._blob = bytearray()
+        # _offsets[i] is where chunk i starts; the last entry is the end.
+        self._offsets = array('Q', [0])
+
+    def extend(self, chunks: Iterable[str]):
+        """Appends chunks to the store."""
+        for chunk in chunks:
+            self._blob += chunk.encode('utf-8')
+            self._offsets.append(len(self._blob))
+
+    def __len__(self) -> int:
+        return len(self._offsets) - 1
+
+    def __getitem__(self, index) -> str:
+        index = operator.index(index)
+        size = len(self)
+        if index < 0:
+            index += size
+        if not 0 <= index < size:
+            raise IndexError("chunk index out of range")
+        return self._blob[self._offsets[index]:self._offsets[index + 1]].decode('utf-8')
+
+    def __iter__(self) -> Iterator[str]:
+        for index in range(len(self)):
+            yield self[index]
 
 class RAGSession:
     """
@@ -13,18 +87,29 @@ class RAGSession:
     """
     def __init__(self, source: str, embedding_model):
         self.source = source
-        self.last_accessed = datetime.datetime.now()
+        self.last_accessed = time.monotonic()
         self.embedding_model = embedding_model
 
         d_model = self.embedding_model.get_sentence_embedding_dimension()
 
-        # Create an in-memory FAISS index. IndexFlatL2 is a simple, fast index
-        # for dense vectors.
-        self.index = faiss.IndexFlatL2(d_model)
+        # A binary FAISS index over 1-bit-per-dimension codes. Hamming
+        # distance on these codes gives a cheap first-pass ranking that moves
+        # 32x fewer bytes than scanning the float32 vectors.
+        self.binary_index = faiss.IndexBinaryFlat(d_model)
+
+        # int8-quantized L2-normalized embeddings and their per-row scales,
+        # used to re-score the binary candidates. Row i corresponds to
+        # self.chunks[i]; they take a quarter of the memory of float32.
+        # The buffers grow geometrically and only the first _size rows are
+        # in use, so ingesting batch by batch does not copy every row again
+        # for each batch.
+        self._codes = np.empty((0, d_model), dtype=np.int8)
+        self._scales = np.empty(0, dtype='float32')
+        self._size = 0
 
         # In-memory store for the actual text chunks corresponding to the vectors.
-        # The index in this list is the ID used in the FAISS index.
-        self.chunks = []
+        # The index in this store is the ID used in the FAISS index.
+        self.chunks = ChunkStore()
 
     def ingest(self, text_chunks: list[str], embeddings: np.ndarray):
         """
@@ -34,72 +119,138 @@ class RAGSession:
         Args:
             text_chunks: A list of strings, where each string is a chunk of the
                          source document.
-            embeddings: A numpy array of the embeddings for the text chunks.
+            embeddings: A numpy array of the L2-normalized embeddings for the
+                        text chunks.
         """
         if not text_chunks:
             return
 
-        # FAISS requires a flat numpy array of float32.
-        embeddings_float32 = np.array(embeddings, dtype='float32')
+        # FAISS requires a contiguous numpy array of float32.
+        embeddings_float32 = np.ascontiguousarray(embeddings, dtype='float32')
 
-        # Add the new embeddings to the FAISS index.
-        self.index.add(embeddings_float32)
+        # Add the binary codes to the FAISS index and keep int8 vectors for
+        # re-scoring.
+        self.binary_index.add(binarize(embeddings_float32))
+        codes, scales = quantize_int8(embeddings_float32)
+        start, end = self._size, self._size + len(codes)
+        self._reserve(end)
+        self._codes[start:end] = codes
+        self._scales[start:end] = scales
+        self._size = end
+        if self.binary_index.ntotal > HNSW_MIN_CHUNKS and not self.uses_graph:
+            self._build_hnsw_index()
 
         # Store the corresponding text chunks.
         self.chunks.extend(text_chunks)
 
-        print(f"Session ingested {self.index.ntotal} chunks.")
+    @property
+    def embeddings(self) -> np.ndarray:
+        """The int8 embeddings of the ingested chunks, one row per chunk."""
+        return self._codes[:self._size]
+
+    @property
+    def binary_codes(self) -> np.ndarray:
+        """
+        The packed binary codes of the ingested chunks, one row per chunk.
+
+        They are read back from the index because they were computed from
+        the float embeddings; binarizing the int8 embeddings would lose the
+        sign of components that round to zero.
+        """
+        return self.binary_index.reconstruct_n(0, self.binary_index.ntotal)
+
+    @property
+    def scales(self) -> np.ndarray:
+        """The dequantization scale of each row of `embeddings`."""
+        return self._scales[:self._size]
+
+    def _reserve(self, rows: int):
+        """Grows the embedding buffers, at least doubling them, to hold `rows` rows."""
+        capacity = len(self._scales)
+        if rows <= capacity:
+            return
+        self._resize(max(rows, 2 * capacity))
+
+    def _resize(self, capacity: int):
+        codes = np.empty((capacity, self._codes.shape[1]), dtype=np.int8)
+        codes[:self._size] = self._codes[:self._size]
+        scales = np.empty(capacity, dtype='float32')
+        scales[:self._size] = self._scales[:self._size]
+        self._codes, self._scales = codes, scales
+
+    def shrink_to_fit(self):
+        """Releases unused buffer capacity once a document is fully ingested."""
+        if len(self._scales) > self._size:
+            self._resize(self._size)
+
+    def _build_hnsw_index(self):
+        """Replaces the flat binary index with an HNSW graph over the same codes."""
+        index = faiss.IndexBinaryHNSW(self.binary_index.d, HNSW_NEIGHBORS)
+        # The graph must be explored widely enough to return a full set of
+        # re-scoring candidates.
+        index.hnsw.efSearch = 2 * RESCORE_CANDIDATES
+        index.add(self.binary_codes)
+        self.binary_index = index
+
+    def score(self, rows: np.ndarray, query_embedding: np.ndarray) -> np.ndarray:
+        """Returns the approximate cosine similarity of the given chunks to a query."""
+        return (self.embeddings[rows].astype('float32') @ query_embedding) * self.scales[rows]
+
+    @property
+    def uses_graph(self) -> bool:
+        """Whether the chunks are indexed with an HNSW graph rather than scanned."""
+        return isinstance(self.binary_index, faiss.IndexBinaryHNSW)
+
+    def candidates(self, query_code: np.ndarray) -> np.ndarray:
+        """Returns the chunks closest to a packed query code in Hamming distance."""
+        if len(self.chunks) <= RESCORE_CANDIDATES:
+            return np.arange(len(self.chunks))
+        _, candidates = self.binary_index.search(query_code, RESCORE_CANDIDATES)
+        return candidates[0][candidates[0] != -1]
+
+    def _search(self, query_embedding: np.ndarray, k: int) -> list[dict]:
+        """
+        Ranks chunks by Hamming distance to the query's binary code, then
+        re-scores the top candidates with the int8 embeddings.
+        """
+        candidates = self.candidates(binarize(query_embedding[None, :]))
+        scores = self.score(candidates, query_embedding)
+        top = top_k_indices(scores, k)
+
+        return [
+            {"text": self.chunks[candidates[i]], "score": float(scores[i])}
+            for i in top
+        ]
 
-    async def query(self, query_text: str, k: int = 5) -> list[dict]:
+    async def query_with_embedding(self, query_embedding: np.ndarray, k: int = 5) -> list[dict]:
         """
-        Performs a similarity search against the session's document chunks.
+        Performs a similarity search with an already embedded query.
+
+        Lets a caller searching several documents embed the question once
+        and reuse the vector for each of them.
 
         Args:
-            query_text: The user's question.
+            query_embedding: The L2-normalized float32 embedding of the question.
             k: The number of top results to retrieve.
 
         Returns:
             A list of dictionaries, each containing the 'text' of a relevant
-            chunk and its similarity 'score'.
+            chunk and its cosine similarity 'score'.
         """
         import asyncio
-        if self.index.ntotal == 0:
+        if not self.chunks:
             return []
 
-        # Embed the query.
+        # Search the index. Scores are inner products of unit vectors, i.e.
+        # cosine similarities.
         try:
-            query_embedding_raw = await asyncio.wait_for(
-                asyncio.to_thread(self.embedding_model.encode, [query_text], convert_to_numpy=True),
-                timeout=30.0
-            )
-            query_embedding = query_embedding_raw.astype('float32')
-        except asyncio.TimeoutError:
-            raise TimeoutError("Embedding generation for query timed out.")
-
-        # Search the index. `distances` are L2 distances, `indices` are the
-        # integer IDs of the vectors in the index.
-        try:
-            distances, indices = await asyncio.wait_for(
-                asyncio.to_thread(self.index.search, query_embedding, min(k, self.index.ntotal)),
+            return await asyncio.wait_for(
+                asyncio.to_thread(self._search, query_embedding, k),
                 timeout=30.0
             )
         except asyncio.TimeoutError:
             raise TimeoutError("FAISS search for query timed out.")
 
-        results = []
-        for i, vector_id in enumerate(indices[0]):
-            if vector_id != -1:
-                # A simple conversion from L2 distance to a normalized similarity score (0-1).
-                # This is a basic heuristic.
-                score = 1 / (1 + distances[0][i])
-
-                results.append({
-                    "text": self.chunks[vector_id],
-                    "score": float(score)
-                })
-
-        return results
-
     def touch(self):
         """Updates the last_accessed timestamp to the current time."""
-        self.last_accessed = datetime.datetime.now()
+        self.last_accessed = time.monotonic()
@@ -0,0 +1,184 @@
+import heapq
+import threading
+from typing import Dict, List, Optional, Tuple
+from user_session import UserSession
+
+class _Shard:
+    """One partition of the session table, with its lock and expiry heap."""
+    __slots__ = ("sessions", "lock", "expiry_heap")
+
+    def __init__(self):
+        self.sessions: Dict[str, UserSession] = {}
+        self.lock = threading.Lock()
+        # Min-heap of (last_accessed, session_id). An entry may be stale if the
+        # session has been touched since it was pushed; stale entries are
+        # re-pushed with the current timestamp when they reach the top.
+        self.expiry_heap: List[Tuple[float, str]] = []
+
+class SessionStore:
+    """
+    Thread-safe in-memory map of session IDs to UserSession objects.
+
+    Sessions are spread over a fixed number of shards, each a plain dict
+    guarded by its own lock. Requests for different sessions rarely contend
+    on the same lock, and the expiry sweep only ever holds one shard's lock
+    at a time instead of blocking the whole table.
+
+    Each shard also keeps a min-heap ordered by last access time, so the
+    sweep only visits sessions that may have expired rather than scanning
+    every session.
+
+    If max_sessions is set, storing a session beyond it evicts the least
+    recently accessed session of the whole store, so the table cannot grow
+    without bound between sweeps. The candidate is the oldest of the shards'
+    heap tops, so eviction visits each shard once rather than every session.
+    """
+    def __init__(self, num_shards: int = 16, max_sessions: int = 0):
+        if num_shards <= 0 or num_shards & (num_shards - 1):
+            raise ValueError("num_shards must be a positive power of two.")
+        if max_sessions < 0:
+            raise ValueError("max_sessions must not be negative.")
+        self._mask = num_shards - 1
+        self._shards = [_Shard() for _ in range(num_shards)]
+        # 0 means unbounded.
+        self._max_sessions = max_sessions
+        # Serializes evictions so concurrent inserts do not evict twice for
+        # one session over the limit.
+        self._evict_lock = threading.Lock()
+
+    def _shard(self, session_id: str) -> _Shard:
+        return self._shards[hash(session_id) & self._mask]
+
+    def get(self, session_id: str) -> Optional[UserSession]:
+        """Returns the session with the given ID, or None if it does not exist."""
+        shard = self._shard(session_id)
+        with shard.lock:
+            return shard.sessions.get(session_id)
+
+    def __getitem__(self, session_id: str) -> UserSession:
+        user_session = self.get(session_id)
+        if user_session is None:
+            raise KeyError(session_id)
+        return user_session
+
+    def __setitem__(self, session_id: str, user_session: UserSession):
+        shard = self._shard(session_id)
+        with shard.lock:
+            shard.sessions[session_id] = user_session
+            heapq.heappush(shard.expiry_heap, (user_session.last_accessed, session_id))
+        if self._max_sessions:
+            with self._evict_lock:
+                while len(self) > self._max_sessions and self._evict_least_recent():
+                    pass
+
+    @staticmethod
+    def _oldest_entry(shard: _Shard) -> Optional[Tuple[float, str]]:
+        """
+        Returns the heap entry of a shard's least recently accessed session.
+
+        Stale entries found on top of the heap are discarded or re-pushed
+        with the current timestamp. The shard's lock must be held.
+        """
+        heap = shard.expiry_heap
+        while heap:
+            last_accessed, session_id = heap[0]
+            user_session = shard.sessions.get(session_id)
+            if user_session is None:
+                heapq.heappop(heap)
+            elif user_session.last_accessed != last_accessed:
+                heapq.heapreplace(heap, (user_session.last_accessed, session_id))
+            else:
+                return heap[0]
+        return None
+
+    def _evict_least_recent(self) -> bool:
+        """
+        Removes the least recently accessed session of the whole store.
+
+        Returns:
+            False if the store holds no sessions, True otherwise.
+        """
+        oldest = None
+        for shard in self._shards:
+            with shard.lock:
+                entry = self._oldest_entry(shard)
+            if entry is not None and (oldest is None or entry < oldest[0]):
+                oldest = (entry, shard)
+        if oldest is None:
+            return False
+
+        entry, shard = oldest
+        with shard.lock:
+            # The session may have been touched or removed since its shard
+            # was scanned; the caller then checks the size and tries again.
+            if self._oldest_entry(shard) == entry:
+                heapq.heappop(shard.expiry_heap)
+                del shard.sessions[entry[1]]
+        return True
+
+    def __delitem__(self, session_id: str):
+        # The heap entry is left behind and discarded when it reaches the top.
+        shard = self._shard(session_id)
+        with shard.lock:
+            del shard.sessions[session_id]
+
+    def __contains__(self, session_id: str) -> bool:
+        return self.get(session_id) is not None
+
+    def __len__(self) -> int:
+        return sum(len(shard.sessions) for shard in self._shards)
+
+    def clear(self):
+        """Removes all sessions."""
+        for shard in self._shards:
+            with shard.lock:
+                shard.sessions.clear()
+                shard.expiry_heap.clear()
+
+    @property
+    def num_shards(self) -> int:
+        return len(self._shards)
+
+    def remove_expired(self, cutoff: float) -> List[str]:
+        """
+        Removes every session last accessed before `cutoff`, one shard at a time.
+
+        `cutoff` is a time.monotonic() timestamp, like UserSession.last_accessed.
+
+        Only heap entries older than `cutoff` are examined, so the cost is
+        proportional to the number of expired or recently touched sessions
+        rather than the size of the table.
+
+        Returns:
+            The IDs of the removed sessions.
+        """
+        removed = []
+        for index in range(len(self._shards)):
+            removed.extend(self.remove_expired_from_shard(index, cutoff))
+        return removed
+
+    def remove_expired_from_shard(self, index: int, cutoff: float) -> List[str]:
+        """
+        Removes the sessions of a single shard last accessed before `cutoff`.
+
+        Lets an asynchronous caller sweep the store piecewise and yield to
+        the event loop between shards.
+
+        Returns:
+            The IDs of the removed sessions.
+        """
+        removed = []
+        shard = self._shards[index]
+        with shard.lock:
+            heap = shard.expiry_heap
+            while heap and heap[0][0] < cutoff:
+                _, session_id = heapq.heappop(heap)
+                user_session = shard.sessions.get(session_id)
+                if user_session is None:
+                    continue
+                if user_session.last_accessed < cutoff:
+                    del shard.sessions[session_id]
+                    removed.append(session_id)
+                else:
+                    heapq.heappush(heap, (user_session.last_accessed, session_id))
+        return removed
@@ -0,0 +1,6 @@
+"""Document contents shared by several tests."""
+
+# Two short documents about unrelated things, so a question about one of
+# them should retrieve only that document.
+SKY_DOC = b"The sky is blue and clouds are white."
+GRASS_DOC = b"The grass is green and the soil is brown."
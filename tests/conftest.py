@@ -0,0 +1,94 @@
+"""
+Shared fixtures for the API tests.
+
+The app's lifespan is entered once for the whole test session, with the
+embedding model replaced by a deterministic bag-of-words encoder, and every
+test gets a clean set of sessions and caches.
+"""
+import functools
+import os
+import re
+import zlib
+from contextlib import contextmanager
+from unittest.mock import patch
+
+import numpy as np
+import pytest
+from fastapi.testclient import TestClient
+
+# Set a dummy API key for tests if not already set, and keep the app from
+# scheduling its session cleanup task; tests run cleanup directly.
+os.environ.setdefault('GOOGLE_API_KEY', 'test-key')
+os.environ['DOCQA_DISABLE_BG_TASKS'] = '1'
+
+from app import app, sessions
+
+@functools.lru_cache(maxsize=4096)
+def _fake_embedding(text: str, dim: int) -> np.ndarray:
+    """Sums a fixed random vector per lowercase word; cached since tests reuse texts."""
+    embedding = np.zeros(dim, dtype="float32")
+    for word in re.findall(r"\w+", text.lower()):
+        rng = np.random.default_rng(zlib.crc32(word.encode("utf-8")))
+        embedding += rng.standard_normal(dim).astype("float32")
+    # Cached arrays are shared between calls, so they must not be modified.
+    embedding.flags.writeable = False
+    return embedding
+
+class FakeEncoder:
+    """
+    Deterministic stand-in for the sentence-transformer model.
+
+    A text is embedded as the sum of a fixed random vector per lowercase word,
+    so texts sharing words are close to each other and results are stable
+    across runs.
+    """
+    dim = 64
+
+    def get_sentence_embedding_dimension(self) -> int:
+        return self.dim
+
+    def encode(self, texts, convert_to_numpy=True, normalize_embeddings=False, **kwargs):
+        if not texts:
+            return np.zeros((0, self.dim), dtype="float32")
+        # np.stack copies, so the cached vectors are left untouched.
+        embeddings = np.stack([_fake_embedding(text, self.dim) for text in texts])
+        if normalize_embeddings:
+            norms = np.linalg.norm(embeddings, axis=1, keepdims=True)
+            embeddings /= np.where(norms == 0, 1.0, norms)
+        return embeddings
+
+class EncodeCounter:
+    """Wraps an encode method and counts its calls, without mock call recording."""
+    def __init__(self, encode):
+        self._encode = encode
+        self.calls = 0
+
+    def __call__(self, texts, **kwargs):
+        self.calls += 1
+        return self._encode(texts, **kwargs)
+
+@pytest.fixture(scope="session")
+def app_lifespan():
+    """Starts the app once for the whole test session."""
+    with patch("app.load_embedding_model", return_value=FakeEncoder()), \
+            TestClient(app) as test_client:
+        yield test_client
+
+@pytest.fixture
+def client(app_lifespan):
+    """Provides the started app's TestClient with no sessions or cached results."""
+    sessions.clear()
+    yield app_lifespan
+    sessions.clear()
+    for cache in ("embedding_cache", "query_embedding_cache", "answer_cache", "document_text_cache"):
+        getattr(app.state, cache).clear()
+
+@pytest.fixture
+def count_encode_calls(client):
+    """Returns a context manager that counts the embedding model's encode calls within it."""
+    @contextmanager
+    def counting():
+        counter = EncodeCounter(app.state.embedding_model.encode)
+        with patch.object(app.state.embedding_model, "encode", counter):
+            yield counter
+    return counting
@@ -1,26 +1,35 @@
 import pytest
-from fastapi.testclient import TestClient
-from unittest.mock import patch
+from unittest.mock import AsyncMock, MagicMock
+import asyncio
 import os
 import datetime
-
-# Set a dummy API key for tests
-os.environ['GOOGLE_API_KEY'] = 'test-key'
-
-# Mock asyncio.create_task BEFORE the app is imported
-with patch('asyncio.create_task'):
-    from app import app, sessions, _clean_sessions_once
-    from user_session import UserSession
-    from rag_session import RAGSession
-
-# Use a client that handles the lifespan context
-@pytest.fixture
-def client():
-    sessions.clear()
-    # Using the 'with' statement ensures that startup and shutdown events are run
-    with TestClient(app) as test_client:
-        yield test_client
-    sessions.clear()
+import uuid
+import freezegun
+from freezegun import freeze_time
+
+# freeze_time patches every loaded module; skip transformers, whose lazy
+# attributes would otherwise import the whole library on each freeze.
+freezegun.configure(extend_ignore_list=["transformers"])
+
+# Set a dummy API key for tests if not already set
+os.environ.setdefault('GOOGLE_API_KEY', 'test-key')
+
+from app import app, sessions, _clean_sessions_once, generate_rag_response, embed_and_ingest, SESSION_TIMEOUT_MINUTES
+from utils.splitter import split_text_iter
+from user_session import UserSession
+from rag_session import RAGSession
+
+def ingest_text(session_id: str, text: str, source: str) -> str:
+    """
+    Adds a document to a session without going through the ingest endpoint,
+    for tests that only need the document in place. Requires the client's
+    lifespan to have loaded the embedding model.
+    """
+    rag_session = RAGSession(source=source, embedding_model=app.state.embedding_model)
+    asyncio.run(embed_and_ingest(split_text_iter(text), rag_session))
+    doc_id = uuid.uuid4().hex
+    sessions[session_id].add_doc(doc_id, rag_session)
+    return doc_id
 
 def test_create_session(client):
     """Tests that a new user session can be created."""
@@ -51,42 +60,110 @@ def test_ingest_into_session(client, mocker):
     doc_id = data["doc_id"]
     assert user_session.get_doc(doc_id) is not None
 
-def test_query_session(client, mocker):
-    """Tests querying documents within a session."""
+def test_ingest_latin1_file_of_unknown_type(client):
+    """Tests that a text upload of an unlisted type in a legacy encoding is ingested."""
     session_id = client.post("/sessions").json()["session_id"]
-    mocker.patch("app.load_source", return_value="Content A")
-    resp_a = client.post(f"/sessions/{session_id}/ingest", files={"file": ("doc_a.txt", b"A", "text/plain")})
-    doc_id_a = resp_a.json()["doc_id"]
 
-    mocker.patch("app.load_source", return_value="Content B")
-    resp_b = client.post(f"/sessions/{session_id}/ingest", files={"file": ("doc_b.txt", b"B", "text/plain")})
-    doc_id_b = resp_b.json()["doc_id"]
+    content = "Nightly backup finished, r\xe9sum\xe9 of errors: none.\n".encode("latin-1")
+    response = client.post(
+        f"/sessions/{session_id}/ingest",
+        files={"file": ("a.log", content, "text/plain")}
+    )
+    assert response.status_code == 200
+    assert response.json()["num_chunks"] == 1
 
-    user_session = sessions[session_id]
-    mocker.patch.object(user_session.get_doc(doc_id_a), 'query', return_value=[{"text": "from A", "score": 0.9}])
-    mocker.patch.object(user_session.get_doc(doc_id_b), 'query', return_value=[{"text": "from B", "score": 0.8}])
+def test_ingest_in_multiple_batches(client, mocker):
+    """Tests that a document larger than one embedding batch is fully ingested."""
+    session_id = client.post("/sessions").json()["session_id"]
+
+    mocker.patch("app.INGEST_EMBED_BATCH", 2)
+    mocker.patch("app.load_source", return_value=" ".join(f"sentence{i}" for i in range(300)))
+    response = client.post(
+        f"/sessions/{session_id}/ingest",
+        files={"file": ("long.txt", b"...", "text/plain")}
+    )
+    assert response.status_code == 200
+    num_chunks = response.json()["num_chunks"]
+    assert num_chunks > 2
+
+    rag_session = sessions[session_id].get_doc(response.json()["doc_id"])
+    assert len(rag_session.chunks) == num_chunks
+    assert rag_session.embeddings.shape[0] == num_chunks
+    assert rag_session.scales.shape[0] == num_chunks
+    # Spare capacity from growing the buffers is released after ingestion.
+    assert rag_session.embeddings.base is not None
+    assert rag_session.embeddings.base.shape[0] == num_chunks
+
+def test_failed_embedding_stops_the_chunk_producer(mocker):
+    """Tests that an embedding failure does not leave the splitting task blocked on a full queue."""
+    mocker.patch("app.INGEST_EMBED_BATCH", 1)
+
+    async def slow_failing_embed(chunks):
+        # Give the producer time to fill the queue before failing.
+        await asyncio.sleep(0.05)
+        raise TimeoutError("Embedding timed out.")
+    mocker.patch("app.embed_batch", side_effect=slow_failing_embed)
+    embedding_model = MagicMock()
+    embedding_model.get_sentence_embedding_dimension.return_value = 64
+    rag_session = RAGSession(source="doc.txt", embedding_model=embedding_model)
+
+    async def ingest_and_collect_leftover_tasks():
+        chunks = (f"chunk {i}" for i in range(100))
+        with pytest.raises(TimeoutError):
+            await embed_and_ingest(chunks, rag_session)
+        # Let the cancelled producer run to completion.
+        for _ in range(10):
+            await asyncio.sleep(0)
+        return asyncio.all_tasks() - {asyncio.current_task()}
+
+    assert asyncio.run(ingest_and_collect_leftover_tasks()) == set()
+
+def test_ingest_rejects_oversized_upload(client, mocker):
+    """Tests that an upload larger than the document size limit is rejected."""
+    session_id = client.post("/sessions").json()["session_id"]
+
+    mocker.patch("app.MAX_DOCUMENT_BYTES", 10)
+    response = client.post(
+        f"/sessions/{session_id}/ingest",
+        files={"file": ("big.txt", b"x" * 11, "text/plain")}
+    )
+    assert response.status_code == 413
+    assert len(sessions[session_id].docs) == 0
+
+def test_query_session(client, mocker):
+    """Tests querying all documents, or a selected one, within a session."""
+    session_id = client.post("/sessions").json()["session_id"]
+    doc_id_a = ingest_text(session_id, "Content A", "doc_a.txt")
+    doc_id_b = ingest_text(session_id, "Content B", "doc_b.txt")
 
     # Mock the async generator
     async def mock_async_gen(*args, **kwargs):
         yield "Final Answer"
-    mocker.patch("app.generate_rag_response", side_effect=mock_async_gen)
+    mock_generate = mocker.patch("app.generate_rag_response", side_effect=mock_async_gen)
 
-    # Query all docs in session
+    # Query all docs in session, through the session-wide index
     response_all = client.post(f"/sessions/{session_id}/query", json={"q": "test"})
     assert response_all.status_code == 200
     assert response_all.json()["answer"] == "Final Answer"
-
-    # Query a specific doc in session
+    sources_all = response_all.json()["sources"]
+    assert {s["doc_id"] for s in sources_all} == {doc_id_a, doc_id_b}
+    assert {(s["source"], s["text"]) for s in sources_all} == {
+        ("doc_a.txt", "Content A"), ("doc_b.txt", "Content B")
+    }
+    assert sorted(mock_generate.call_args.args[1]) == ["Content A", "Content B"]
+
+    # Query a specific doc in session, through its own index
     response_specific = client.post(f"/sessions/{session_id}/query", json={"q": "test", "doc_ids": [doc_id_a]})
     assert response_specific.status_code == 200
     assert response_specific.json()["answer"] == "Final Answer"
+    sources_specific = response_specific.json()["sources"]
+    assert [(s["doc_id"], s["text"]) for s in sources_specific] == [(doc_id_a, "Content A")]
+    assert mock_generate.call_args.args[1] == ["Content A"]
 
-def test_delete_document_from_session(client, mocker):
+def test_delete_document_from_session(client):
     """Tests deleting a document from a session."""
     session_id = client.post("/sessions").json()["session_id"]
-    mocker.patch("app.load_source", return_value="Test content")
-    resp = client.post(f"/sessions/{session_id}/ingest", files={"file": ("test.txt", b"...", "text/plain")})
-    doc_id = resp.json()["doc_id"]
+    doc_id = ingest_text(session_id, "Test content", "test.txt")
 
     assert len(sessions[session_id].docs) == 1
 
@@ -97,32 +174,59 @@ def test_delete_document_from_session(client, mocker):
 
 def test_session_cleanup_logic():
     """Tests the single-pass cleanup logic directly."""
-    sessions.clear()
+    # The sessions hold no chunks, so any model reporting a dimension will do;
+    # this keeps the test independent of whichever tests ran before it.
+    embedding_model = MagicMock()
+    embedding_model.get_sentence_embedding_dimension.return_value = 64
+    fresh_id, expired_id = uuid.uuid4().hex, uuid.uuid4().hex
+
+    with freeze_time("2024-01-01 12:00:00") as frozen:
+        expired_session = UserSession()
+        expired_session.add_doc("doc2", RAGSession(source="expired.txt", embedding_model=embedding_model))
+        sessions[expired_id] = expired_session
+
+        frozen.tick(datetime.timedelta(minutes=SESSION_TIMEOUT_MINUTES + 1))
+
+        fresh_session = UserSession()
+        fresh_session.add_doc("doc1", RAGSession(source="fresh.txt", embedding_model=embedding_model))
+        sessions[fresh_id] = fresh_session
 
-    # We need the model to instantiate the RAGSession
-    # In a real test setup, we might mock this, but for now, we rely on the app state
-    # This test must run within a context where the app lifespan has started.
-    # For direct calling, we can manually set it if needed, or rely on other tests
-    # having populated it. Let's ensure it's there.
-    if not hasattr(app.state, "embedding_model"):
-        from sentence_transformers import SentenceTransformer
-        app.state.embedding_model = SentenceTransformer('paraphrase-multilingual-mpnet-base-v2')
+        assert fresh_id in sessions
+        assert expired_id in sessions
 
-    fresh_session = UserSession()
-    fresh_session.add_doc("doc1", RAGSession(source="fresh.txt", embedding_model=app.state.embedding_model))
-    sessions["fresh_session"] = fresh_session
+        asyncio.run(_clean_sessions_once())
 
-    expired_session = UserSession()
-    expired_session.add_doc("doc2", RAGSession(source="expired.txt", embedding_model=app.state.embedding_model))
-    expired_session.last_accessed = datetime.datetime.now() - datetime.timedelta(minutes=20)
-    sessions["expired_session"] = expired_session
+    assert fresh_id in sessions
+    assert expired_id not in sessions
 
-    assert "fresh_session" in sessions
-    assert "expired_session" in sessions
+def test_identical_concurrent_generations_share_one_call(mocker):
+    """Tests that concurrent requests with the same prompt make a single LLM call."""
+    async def slow_generate_content(model, contents):
+        await asyncio.sleep(0.01)
+        return MagicMock(text=" Shared answer ")
+    mock_ai_client = mocker.patch("app.ai_client")
+    mock_ai_client.aio.models.generate_content = AsyncMock(side_effect=slow_generate_content)
 
-    _clean_sessions_once()
+    async def ask():
+        return [answer async for answer in generate_rag_response("question", ["context"])]
+
+    async def ask_concurrently():
+        return await asyncio.gather(ask(), ask())
+
+    assert asyncio.run(ask_concurrently()) == [["Shared answer"], ["Shared answer"]]
+    assert mock_ai_client.aio.models.generate_content.call_count == 1
+
+def test_identical_upload_is_parsed_once(client, mocker):
+    """Tests that uploading the same document again reuses its extracted text."""
+    session_id = client.post("/sessions").json()["session_id"]
+    mock_load_source = mocker.patch("app.load_source", return_value="Parsed PDF content")
 
-    assert "fresh_session" in sessions
-    assert "expired_session" not in sessions
+    for _ in range(2):
+        response = client.post(
+            f"/sessions/{session_id}/ingest",
+            files={"file": ("report.pdf", b"%PDF-1.4 same bytes", "application/pdf")}
+        )
+        assert response.status_code == 200
 
-    sessions.clear()
+    assert mock_load_source.call_count == 1
+    assert len(sessions[session_id].docs) == 2
@@ -0,0 +1,17 @@
+"""Tests for the process-wide embedding cache."""
+import numpy as np
+from embedding_cache import EmbeddingCache
+
+def test_embedding_cache_evicts_least_recently_used():
+    """Tests that the embedding cache drops the least recently used entry when full."""
+    cache = EmbeddingCache(max_entries=2)
+    cache.update({"a": np.zeros(3, dtype="float32"), "b": np.ones(3, dtype="float32")})
+
+    # Reading "a" makes "b" the least recently used entry.
+    assert cache.get("a") is not None
+    cache.update({"c": np.full(3, 2, dtype="float32")})
+
+    assert len(cache) == 2
+    assert "a" in cache
+    assert "b" not in cache
+    assert cache.get_many(["b", "c"])[0] is None
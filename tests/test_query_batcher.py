@@ -0,0 +1,23 @@
+"""Tests for the query embedding batcher."""
+import asyncio
+from unittest.mock import MagicMock
+import numpy as np
+from query_batcher import QueryBatcher
+
+def test_concurrent_queries_share_one_forward_pass():
+    """Tests that questions embedded concurrently are encoded in a single batch."""
+    embedding_model = MagicMock()
+    embedding_model.encode.side_effect = lambda texts, **kwargs: np.eye(len(texts), 4, dtype="float32")
+
+    async def embed_concurrently():
+        batcher = QueryBatcher(embedding_model, max_batch_size=32, max_wait_seconds=0.01)
+        batcher.start()
+        try:
+            return await asyncio.gather(*(batcher.embed(f"question {i}") for i in range(3)))
+        finally:
+            await batcher.stop()
+
+    embeddings = asyncio.run(embed_concurrently())
+    assert embedding_model.encode.call_count == 1
+    assert embedding_model.encode.call_args.args[0] == ["question 0", "question 1", "question 2"]
+    assert [embedding.argmax() for embedding in embeddings] == [0, 1, 2]
@@ -0,0 +1,117 @@
+"""Tests for document and session-wide search."""
+import asyncio
+from unittest.mock import MagicMock
+import numpy as np
+import pytest
+from rag_session import RAGSession, ChunkStore, binarize, top_k_indices
+from user_session import UserSession
+
+def test_large_document_switches_to_hnsw_index(mocker):
+    """Tests that a document past the HNSW threshold is searched through an HNSW graph."""
+    import faiss
+    mocker.patch("rag_session.HNSW_MIN_CHUNKS", 10)
+    mocker.patch("rag_session.RESCORE_CANDIDATES", 5)
+    embedding_model = MagicMock()
+    embedding_model.get_sentence_embedding_dimension.return_value = 64
+
+    rng = np.random.default_rng(0)
+    embeddings = rng.standard_normal((20, 64)).astype("float32")
+    # A small positive component rounds to zero in int8 but must keep its
+    # sign bit in the binary codes.
+    embeddings[:, 0] = 1e-4
+    embeddings /= np.linalg.norm(embeddings, axis=1, keepdims=True)
+
+    rag_session = RAGSession(source="large.txt", embedding_model=embedding_model)
+    rag_session.ingest([f"chunk {i}" for i in range(8)], embeddings[:8])
+    assert isinstance(rag_session.binary_index, faiss.IndexBinaryFlat)
+    rag_session.ingest([f"chunk {i}" for i in range(8, 20)], embeddings[8:])
+    assert isinstance(rag_session.binary_index, faiss.IndexBinaryHNSW)
+    assert rag_session.binary_index.ntotal == 20
+    assert np.array_equal(rag_session.binary_codes, binarize(embeddings))
+
+    results = asyncio.run(rag_session.query_with_embedding(embeddings[13], k=1))
+    assert results[0]["text"] == "chunk 13"
+
+    # Querying the whole session searches the large document through its
+    # graph, not through the session-wide flat index.
+    small_session = RAGSession(source="small.txt", embedding_model=embedding_model)
+    small_session.ingest(["small chunk"], embeddings[13:14])
+    user_session = UserSession()
+    user_session.add_doc("large", rag_session)
+    user_session.add_doc("small", small_session)
+    assert user_session.binary_index.ntotal == 1
+    assert np.array_equal(user_session.binary_index.reconstruct(0), binarize(embeddings[13]))
+
+    results = user_session.search(embeddings[13], k=2)
+    assert {(r["doc_id"], r["text"]) for r in results} == {("large", "chunk 13"), ("small", "small chunk")}
+
+    user_session.remove_doc("large")
+    assert [r["doc_id"] for r in user_session.search(embeddings[13], k=2)] == ["small"]
+
+def test_search_is_safe_while_documents_change():
+    """Tests that searches in worker threads never see a half-updated session index."""
+    import threading
+    embedding_model = MagicMock()
+    embedding_model.get_sentence_embedding_dimension.return_value = 64
+    rng = np.random.default_rng(0)
+
+    def make_doc(num_chunks: int) -> RAGSession:
+        embeddings = rng.standard_normal((num_chunks, 64)).astype("float32")
+        embeddings /= np.linalg.norm(embeddings, axis=1, keepdims=True)
+        rag_session = RAGSession(source="doc.txt", embedding_model=embedding_model)
+        rag_session.ingest([f"chunk {i}" for i in range(num_chunks)], embeddings)
+        return rag_session
+
+    user_session = UserSession()
+    docs = [make_doc(50 + 10 * i) for i in range(4)]
+    for i, rag_session in enumerate(docs):
+        user_session.add_doc(f"doc{i}", rag_session)
+
+    query_embedding = docs[0].embeddings[0].astype("float32")
+    query_embedding /= np.linalg.norm(query_embedding)
+    errors = []
+    stop = threading.Event()
+
+    def search_repeatedly():
+        while not stop.is_set():
+            try:
+                user_session.search(query_embedding, k=5)
+            except Exception as e:
+                errors.append(e)
+
+    threads = [threading.Thread(target=search_repeatedly) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    try:
+        for _ in range(200):
+            for i, rag_session in enumerate(docs):
+                user_session.remove_doc(f"doc{i}")
+                user_session.add_doc(f"doc{i}", rag_session)
+    finally:
+        stop.set()
+        for thread in threads:
+            thread.join()
+
+    assert errors == []
+
+def test_chunk_store_round_trips_text():
+    """Tests that chunks read back from the shared buffer match what was stored."""
+    chunks = ChunkStore()
+    assert len(chunks) == 0
+    assert not chunks
+
+    stored = ["plain text", "", "naïve café ✓", "日本語のテキスト"]
+    chunks.extend(stored)
+
+    assert len(chunks) == len(stored)
+    assert list(chunks) == stored
+    assert chunks[np.int64(2)] == "naïve café ✓"
+    assert chunks[-1] == "日本語のテキスト"
+    with pytest.raises(IndexError):
+        chunks[len(stored)]
+
+def test_top_k_indices_orders_best_first():
+    """Tests that top-k selection returns the highest scores in descending order."""
+    scores = np.array([0.1, 0.9, 0.3, 0.7, 0.5], dtype="float32")
+    assert top_k_indices(scores, 3).tolist() == [1, 3, 4]
+    assert top_k_indices(scores, 10).tolist() == [1, 3, 4, 2, 0]
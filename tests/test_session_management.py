@@ -3,10 +3,13 @@
 import sys
 import datetime
 from typing import Dict
-import uuid
+import os
+from freezegun import freeze_time
 
 # Mock the session management logic directly
 class MockUserSession:
+    __slots__ = ("last_accessed", "docs", "embedding_cache")
+
     def __init__(self):
         self.last_accessed = datetime.datetime.now()
         self.docs = {}
@@ -21,7 +24,7 @@ SESSION_TIMEOUT_MINUTES = 15
 
 def create_session():
     """Mock session creation."""
-    session_id = uuid.uuid4().hex
+    session_id = os.urandom(16).hex()
     sessions[session_id] = MockUserSession()
     return {"session_id": session_id}
 
@@ -115,16 +118,17 @@ def test_session_status_nonexistent():
 
 def test_session_refresh():
     """Test session refresh."""
-    session_data = create_session()
-    session_id = session_data["session_id"]
-    
-    # Wait a moment
-    import time
-    time.sleep(0.1)
-    
-    refresh_result = refresh_session(session_id)
+    with freeze_time("2024-01-01 12:00:00") as frozen:
+        session_data = create_session()
+        session_id = session_data["session_id"]
+
+        # Let a moment pass
+        frozen.tick(datetime.timedelta(seconds=5))
+
+        refresh_result = refresh_session(session_id)
     assert refresh_result["session_id"] == session_id
     assert refresh_result["remaining_minutes"] == SESSION_TIMEOUT_MINUTES
+    assert refresh_result["refreshed_at"] == "2024-01-01T12:00:05"
     print("✓ Session refresh test passed")
 
 def test_session_health_active():
@@ -138,49 +142,53 @@ def test_session_health_active():
 
 def test_session_expired():
     """Test expired session behavior."""
-    session_data = create_session()
-    session_id = session_data["session_id"]
-    
-    # Manually expire the session
-    user_session = sessions[session_id]
-    user_session.last_accessed = datetime.datetime.now() - datetime.timedelta(minutes=SESSION_TIMEOUT_MINUTES + 1)
-    
-    # Status should show inactive
-    status = get_session_status(session_id)
-    assert status["active"] is False
-    
-    # Health check should fail
-    try:
-        session_health_check(session_id)
-        assert False, "Health check should have failed"
-    except Exception as e:
-        assert "expired" in str(e).lower()
+    with freeze_time("2024-01-01 12:00:00") as frozen:
+        session_data = create_session()
+        session_id = session_data["session_id"]
+
+        # Let the session expire
+        frozen.tick(datetime.timedelta(minutes=SESSION_TIMEOUT_MINUTES + 1))
+
+        # Status should show inactive
+        status = get_session_status(session_id)
+        assert status["active"] is False
+
+        # Health check should fail
+        try:
+            session_health_check(session_id)
+            assert False, "Health check should have failed"
+        except Exception as e:
+            assert "expired" in str(e).lower()
     
     print("✓ Expired session test passed")
 
 def test_session_workflow():
     """Test complete session workflow."""
-    # Create session
-    session_data = create_session()
-    session_id = session_data["session_id"]
-    
-    # Check initial status
-    status = get_session_status(session_id)
-    assert status["active"] is True
-    initial_remaining = status["remaining_minutes"]
-    
-    # Health check should pass
-    health = session_health_check(session_id)
-    assert health["status"] == "active"
-    
-    # Refresh session
-    refresh_result = refresh_session(session_id)
-    assert refresh_result["remaining_minutes"] == SESSION_TIMEOUT_MINUTES
-    
-    # Status should show full time after refresh
-    status_after_refresh = get_session_status(session_id)
-    new_remaining = status_after_refresh["remaining_minutes"]
-    assert new_remaining >= initial_remaining
+    with freeze_time("2024-01-01 12:00:00") as frozen:
+        # Create session
+        session_data = create_session()
+        session_id = session_data["session_id"]
+
+        # Check initial status
+        frozen.tick(datetime.timedelta(minutes=1))
+        status = get_session_status(session_id)
+        assert status["active"] is True
+        initial_remaining = status["remaining_minutes"]
+        assert initial_remaining == SESSION_TIMEOUT_MINUTES - 1
+
+        # Health check should pass
+        health = session_health_check(session_id)
+        assert health["status"] == "active"
+
+        # Refresh session
+        refresh_result = refresh_session(session_id)
+        assert refresh_result["remaining_minutes"] == SESSION_TIMEOUT_MINUTES
+
+        # Status should show full time after refresh
+        status_after_refresh = get_session_status(session_id)
+        new_remaining = status_after_refresh["remaining_minutes"]
+        assert new_remaining == SESSION_TIMEOUT_MINUTES
+        assert new_remaining > initial_remaining
     
     print("✓ Complete workflow test passed")
 
@@ -0,0 +1,57 @@
+"""Tests for the sharded session store."""
+from session_store import SessionStore
+from user_session import UserSession
+
+def test_session_store_keeps_touched_sessions():
+    """Tests that a session touched after insertion survives an expiry sweep."""
+    store = SessionStore()
+    start = 1000.0
+
+    user_session = UserSession()
+    user_session.last_accessed = start
+    store["touched"] = user_session
+
+    # Simulate activity after the session was stored.
+    user_session.last_accessed = start + 600
+
+    assert store.remove_expired(start + 300) == []
+    assert "touched" in store
+
+    assert store.remove_expired(start + 660) == ["touched"]
+    assert "touched" not in store
+
+def test_session_store_evicts_least_recently_used_when_full():
+    """Tests that a full store evicts the session accessed longest ago."""
+    store = SessionStore(num_shards=1, max_sessions=2)
+    first, second, third = UserSession(), UserSession(), UserSession()
+    first.last_accessed, second.last_accessed = 100.0, 200.0
+    store["first"] = first
+    store["second"] = second
+
+    # "first" is used again, so "second" becomes the least recently used.
+    first.last_accessed = 300.0
+    third.last_accessed = 400.0
+    store["third"] = third
+
+    assert len(store) == 2
+    assert "first" in store
+    assert "second" not in store
+    assert "third" in store
+
+def test_session_store_limit_applies_across_shards():
+    """Tests that sharding neither evicts early nor evicts anything but the oldest session."""
+    store = SessionStore(num_shards=16, max_sessions=16)
+    for i in range(16):
+        user_session = UserSession()
+        user_session.last_accessed = float(i)
+        store[f"session{i}"] = user_session
+    assert len(store) == 16
+
+    newest = UserSession()
+    newest.last_accessed = 100.0
+    store["newest"] = newest
+
+    assert len(store) == 16
+    assert "session0" not in store
+    assert all(f"session{i}" in store for i in range(1, 16))
+    assert "newest" in store
@@ -1,5 +1,5 @@
 import pytest
-from utils.splitter import split_text
+from utils.splitter import split_text, split_text_iter
 from utils.loaders import load_source
 from utils.exceptions import DocumentLoaderError
 
@@ -40,6 +40,19 @@ def test_split_text_whitespace():
     for chunk in chunks:
         assert len(chunk) <= max_chars
 
+def test_split_text_iter_matches_split_text():
+    """Tests that the lazy splitter yields the same chunks as split_text."""
+    text = "word " * 400
+    chunks = split_text_iter(text, max_chars=50, overlap=10)
+    assert not isinstance(chunks, list)
+    assert list(chunks) == split_text(text, max_chars=50, overlap=10)
+
+def test_split_text_stops_at_first_window_reaching_end():
+    """Tests that no extra tail chunk follows a window that already covers the end."""
+    text = "a" * 850
+    chunks = split_text(text, max_chars=500, overlap=100)
+    assert [len(chunk) for chunk in chunks] == [500, 450]
+
 # --- Tests for utils.loaders ---
 
 def test_load_source_txt():
@@ -48,6 +61,20 @@ def test_load_source_txt():
     text = load_source(content, ".txt")
     assert text == "This is a test."
 
+def test_load_source_from_path(tmp_path):
+    """Tests loading text and HTML files from disk, including an empty file."""
+    txt_file = tmp_path / "doc.txt"
+    txt_file.write_bytes(b"This is a test.")
+    assert load_source(txt_file, ".txt") == "This is a test."
+
+    html_file = tmp_path / "doc.html"
+    html_file.write_bytes(b"<html><body><script>bad()</script><p>Hello</p></body></html>")
+    assert load_source(html_file, ".html") == "Hello"
+
+    empty_file = tmp_path / "empty.txt"
+    empty_file.write_bytes(b"")
+    assert load_source(empty_file, ".txt") == ""
+
 def test_load_source_html():
     """Tests loading an HTML file and stripping scripts."""
     html_content = b"<html><head><script>alert('bad');</script></head><body><p>Hello</p></body></html>"
@@ -68,6 +95,31 @@ def test_load_source_unsupported_but_decodable():
     text = load_source(content, ".fake")
     assert text == "This is decodable."
 
+def test_load_source_latin1_text_of_unknown_type(tmp_path):
+    """Tests that non-UTF-8 text of an unknown type is converted rather than rejected."""
+    path = tmp_path / "server.log"
+    path.write_bytes("Request served in 12 ms, r\xe9sum\xe9 saved.\n".encode("latin-1"))
+    text = load_source(path, ".log")
+    assert "Request served in 12 ms" in text
+
+@pytest.mark.parametrize("encoding", ["utf-16", "utf-32"])
+def test_load_source_text_with_byte_order_mark(encoding):
+    """Tests that UTF-16 and UTF-32 text, which contains NUL bytes, is not taken for binary."""
+    content = "Tab\tseparated\tvalues".encode(encoding)
+    assert load_source(content, ".tsv") == "Tab\tseparated\tvalues"
+
+@pytest.mark.parametrize("ext", [".php", ".aspx", ".xhtml"])
+def test_load_source_html_under_other_extension(ext):
+    """Tests that a page served under a non-HTML extension is still parsed as HTML."""
+    html_content = (
+        b"\n<!DOCTYPE html><html><head><script>track();</script></head>"
+        b"<body><p>Main article text</p></body></html>"
+    )
+    text = load_source(html_content, ext)
+    assert "Main article text" in text
+    assert "track" not in text
+    assert "<p>" not in text
+
 def test_load_source_pdf_mocked(mocker):
     """Tests PDF loading by mocking PyPDF2."""
     mock_pdf_reader = mocker.patch('PyPDF2.PdfReader')
@@ -93,3 +145,44 @@ def test_load_source_docx_mocked(mocker):
 
     assert text == "This is a DOCX paragraph.\nThis is a DOCX paragraph."
     mock_docx_document.assert_called_once()
+
+def test_pdf_text_extracts_every_page(tmp_path, mocker):
+    """Tests that PDFs are read with PyMuPDF, returning the text of each page in order."""
+    import fitz
+    pdf_path = tmp_path / "two_pages.pdf"
+    with fitz.open() as doc:
+        for page_text in ["First page text", "Second page text"]:
+            doc.new_page().insert_text((72, 72), page_text)
+        doc.save(pdf_path)
+    mock_markitdown = mocker.patch('utils.loaders.MarkItDown')
+
+    text = load_source(pdf_path, ".pdf")
+
+    assert text.split() == ["First", "page", "text", "Second", "page", "text"]
+    mock_markitdown.assert_not_called()
+
+def test_pdf_falls_back_to_markitdown(tmp_path, mocker):
+    """Tests that a PDF PyMuPDF cannot read is passed to MarkItDown."""
+    pdf_path = tmp_path / "broken.pdf"
+    pdf_path.write_bytes(b"%PDF-1.4 not really a pdf")
+    mock_markitdown = mocker.patch('utils.loaders.MarkItDown')
+    mock_markitdown.return_value.convert.return_value.text_content = "Recovered text"
+
+    assert load_source(pdf_path, ".pdf") == "Recovered text"
+
+@pytest.mark.parametrize("has_selectolax", [True, False])
+def test_html_text_matches_with_either_parser(mocker, has_selectolax):
+    """Tests that selectolax and the BeautifulSoup fallback strip the same non-content tags."""
+    mocker.patch('utils.loaders._HAS_SELECTOLAX', has_selectolax)
+    html_content = (
+        b"<html><head><style>p {}</style></head><body><nav>Menu</nav>"
+        b"<p>Main text</p><script>track()</script><footer>Legal</footer></body></html>"
+    )
+    assert load_source(html_content, ".html") == "Main text"
+
+def test_load_source_rejects_binary_file_of_unknown_type(tmp_path):
+    """Tests that a file of unknown type starting with binary data is rejected."""
+    path = tmp_path / "blob.bin"
+    path.write_bytes(b"\x7fELF\x02\x01\x01\x00" + b"valid utf-8 afterwards" * 100)
+    with pytest.raises(DocumentLoaderError, match="Unsupported file type"):
+        load_source(path, ".bin")
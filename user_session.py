@@ -1,7 +1,9 @@
-import datetime
-from typing import Dict
+import threading
+import time
+from typing import Dict, List, Optional, ValuesView
+import faiss
 import numpy as np
-from rag_session import RAGSession
+from rag_session import RAGSession, RESCORE_CANDIDATES, binarize, top_k_indices
 
 class UserSession:
     """
@@ -9,33 +11,152 @@ class UserSession:
 
     This class holds multiple RAGSession objects, each corresponding to an
     ingested document. It also tracks the last access time for the entire
-    user session and maintains a cache for text chunk embeddings to avoid
-    redundant computations.
+    user session.
+
+    The binary codes of every document's chunks are additionally kept in one
+    session-wide FAISS index, so a query across all documents is a single
+    search instead of one search per document. Each document occupies a
+    contiguous range of IDs in that index. Documents large enough to be
+    indexed with an HNSW graph are left out of it and searched through their
+    own graph instead, so they are not scanned exhaustively.
+
+    Queries search the index from worker threads while documents are added
+    and removed on the event loop, so the index, its ID maps and the
+    document map are only read or changed while holding the session's lock.
     """
+    __slots__ = ("last_accessed", "docs", "binary_index", "_next_id", "_id_starts", "_id_doc_ids",
+                 "_graph_doc_ids", "_lock")
+
     def __init__(self):
-        self.last_accessed: datetime.datetime = datetime.datetime.now()
+        # time.monotonic() of the last access. It is unaffected by wall-clock
+        # changes and cheaper to read and compare than a datetime.
+        self.last_accessed: float = time.monotonic()
         self.docs: Dict[str, RAGSession] = {}
-        self.embedding_cache: Dict[str, np.ndarray] = {}
+        self.binary_index: Optional[faiss.IndexBinaryIDMap2] = None
+        self._next_id = 0
+        # Sorted start IDs of each document's range and the matching doc IDs.
+        # The starts are kept as an array so a search can map all of its
+        # candidate IDs to documents with one np.searchsorted call.
+        self._id_starts = np.empty(0, dtype='int64')
+        self._id_doc_ids: List[str] = []
+        # Documents searched through their own HNSW graph.
+        self._graph_doc_ids: List[str] = []
+        self._lock = threading.Lock()
 
     def add_doc(self, doc_id: str, rag_session: RAGSession):
         """Adds a new document session to this user's collection."""
-        self.docs[doc_id] = rag_session
+        num_chunks = len(rag_session.chunks)
+        in_flat_index = num_chunks and not rag_session.uses_graph
+        codes = rag_session.binary_codes if in_flat_index else None
+        with self._lock:
+            self._remove_doc_locked(doc_id)
+            self.docs[doc_id] = rag_session
+            if rag_session.uses_graph:
+                self._graph_doc_ids.append(doc_id)
+            elif num_chunks:
+                if self.binary_index is None:
+                    self.binary_index = faiss.IndexBinaryIDMap2(
+                        faiss.IndexBinaryFlat(rag_session.binary_index.d)
+                    )
+                start = self._next_id
+                self.binary_index.add_with_ids(
+                    codes, np.arange(start, start + num_chunks, dtype='int64')
+                )
+                self._next_id += num_chunks
+                self._id_starts = np.append(self._id_starts, start)
+                self._id_doc_ids.append(doc_id)
         self.touch()
 
     def remove_doc(self, doc_id: str):
         """Removes a document session from this user's collection."""
-        if doc_id in self.docs:
-            del self.docs[doc_id]
+        with self._lock:
+            removed = self._remove_doc_locked(doc_id)
+        if removed:
             self.touch()
 
+    def _remove_doc_locked(self, doc_id: str) -> bool:
+        """Removes a document and its index entries. The session's lock must be held."""
+        rag_session = self.docs.pop(doc_id, None)
+        if rag_session is None:
+            return False
+        if doc_id in self._graph_doc_ids:
+            self._graph_doc_ids.remove(doc_id)
+        elif doc_id in self._id_doc_ids:
+            position = self._id_doc_ids.index(doc_id)
+            start = int(self._id_starts[position])
+            self._id_starts = np.delete(self._id_starts, position)
+            del self._id_doc_ids[position]
+            self.binary_index.remove_ids(
+                faiss.IDSelectorRange(start, start + len(rag_session.chunks))
+            )
+        return True
+
     def get_doc(self, doc_id: str) -> RAGSession | None:
         """Retrieves a specific document session."""
         return self.docs.get(doc_id)
 
-    def get_all_docs(self) -> list[RAGSession]:
-        """Returns a list of all document sessions for this user."""
-        return list(self.docs.values())
+    def get_all_docs(self) -> ValuesView[RAGSession]:
+        """Returns a live view of all document sessions for this user, without copying them."""
+        return self.docs.values()
+
+    def search(self, query_embedding: np.ndarray, k: int = 5) -> list[dict]:
+        """
+        Searches all documents in the session with a single index lookup,
+        plus one graph search per document indexed with an HNSW graph.
+
+        Args:
+            query_embedding: The L2-normalized embedding of the user's question.
+            k: The number of top results to retrieve.
+
+        Returns:
+            A list of dictionaries with the 'text', cosine similarity 'score',
+            'doc_id' and 'source' of each relevant chunk, best first.
+        """
+        query_code = binarize(query_embedding[None, :])
+        # (doc_id, rag_session, chunk indices) of each document with candidates.
+        candidates = []
+        with self._lock:
+            if self.binary_index is not None and self.binary_index.ntotal:
+                _, ids = self.binary_index.search(
+                    query_code, min(RESCORE_CANDIDATES, self.binary_index.ntotal)
+                )
+                ids = ids[0][ids[0] != -1]
+
+                # Map every candidate ID to its document and chunk index at once.
+                positions = np.searchsorted(self._id_starts, ids, side='right') - 1
+                chunk_indices = ids - self._id_starts[positions]
+                for position in np.unique(positions):
+                    doc_id = self._id_doc_ids[position]
+                    candidates.append((doc_id, self.docs[doc_id], chunk_indices[positions == position]))
+            graph_docs = [(doc_id, self.docs[doc_id]) for doc_id in self._graph_doc_ids]
+
+        # Documents are not modified once ingested, so graphs are searched and
+        # candidates re-scored without holding the lock.
+        for doc_id, rag_session in graph_docs:
+            candidates.append((doc_id, rag_session, rag_session.candidates(query_code)))
+        if not candidates:
+            return []
+
+        # Re-score with one matrix-vector product per document that has
+        # candidates, rather than one dot product per candidate.
+        scores = np.concatenate([
+            rag_session.score(rows, query_embedding) for _, rag_session, rows in candidates
+        ])
+        owners = np.repeat(np.arange(len(candidates)), [len(rows) for _, _, rows in candidates])
+        rows = np.concatenate([rows for _, _, rows in candidates])
+        top = top_k_indices(scores, k)
+
+        results = []
+        for i in top:
+            doc_id, rag_session, _ = candidates[owners[i]]
+            results.append({
+                "text": rag_session.chunks[rows[i]],
+                "score": float(scores[i]),
+                "doc_id": doc_id,
+                "source": rag_session.source,
+            })
+        return results
 
     def touch(self):
         """Updates the last_accessed timestamp to the current time."""
-        self.last_accessed = datetime.datetime.now()
+        self.last_accessed = time.monotonic()
@@ -1,90 +1,226 @@
-"""Minimal document loaders for the DocQA application."""
-
-import os
-import tempfile
-from markitdown import MarkItDown
-from .exceptions import DocumentLoaderError
-
-def load_source(raw: bytes, ext: str) -> str:
-    """
-    Extracts text content from a raw byte stream using MarkItDown (for office documents)
-    or BeautifulSoup (for HTML/URLs).
-
-    Args:
-        raw: The raw bytes of the file.
-        ext: The file extension (e.g., '.txt', 'pdf', '.html').
-
-    Returns:
-        The extracted text content.
-
-    Raises:
-        DocumentLoaderError: If there's an error during parsing.
-    """
-    ext = ext.lower().strip('.')
-    
-    # Fast-path for plain text and markdown files
-    if ext in ['md', 'txt', 'text']:
-        try:
-            return raw.decode('utf-8')
-        except UnicodeDecodeError:
-            return raw.decode('utf-8', errors='ignore')
-
-    # Fast-path for HTML/URLs using BeautifulSoup to prevent timeouts on large webpages
-    if ext in ['url', 'html', 'htm']:
-        try:
-            from bs4 import BeautifulSoup
-            html = raw.decode('utf-8', errors='ignore')
-            soup = BeautifulSoup(html, 'html.parser')
-            # Decompose tags that do not contain main reading content
-            for tag in soup(['script', 'style', 'nav', 'footer', 'header', 'noscript']):
-                tag.decompose()
-            text_content = soup.get_text(' ', strip=True)
-            if not text_content or not text_content.strip():
-                raise DocumentLoaderError("HTML text extraction resulted in no content.")
-            return text_content
-        except Exception as e:
-            if isinstance(e, DocumentLoaderError):
-                raise
-            raise DocumentLoaderError(f"Failed to parse HTML content: {e}") from e
-
-    md = MarkItDown()
-
-    # MarkItDown prefers working with files, so we write to a temp file
-    with tempfile.NamedTemporaryFile(suffix=f".{ext}", delete=False) as tmp:
-        tmp.write(raw)
-        tmp_path = tmp.name
-
-    try:
-        text_content = ""
-        try:
-            result = md.convert(tmp_path)
-            text_content = result.text_content or ""
-        except Exception as e:
-            if ext == "pdf":
-                # Suppress error and let PyMuPDF handle fallback below
-                pass
-            else:
-                raise DocumentLoaderError(f"Failed to load content with extension '{ext}': {e}") from e
-
-        # If PDF extraction returned no content or failed, run PyMuPDF fallback
-        if ext == "pdf" and (not text_content or not text_content.strip()):
-            try:
-                import fitz
-                doc = fitz.open(tmp_path)
-                texts = [page.get_text() for page in doc]
-                text_content = "\n".join(texts)
-            except Exception as pdf_err:
-                raise DocumentLoaderError(
-                    f"PDF extraction failed using both MarkItDown and PyMuPDF fallback. "
-                    f"PyMuPDF error: {pdf_err}"
-                )
-
-        if not text_content or not text_content.strip():
-            raise DocumentLoaderError("Extraction resulted in no content.")
-        return text_content
-    finally:
-        if os.path.exists(tmp_path):
-            try:
-                os.remove(tmp_path)
-            except OSError:
-                pass
\ No newline at end of file
+"""Minimal document loaders for the DocQA application."""
+
+import codecs
+import io
+import os
+import mmap
+import importlib.util
+import pathlib
+import tempfile
+from contextlib import contextmanager
+from typing import Iterator, Optional, Union
+from markitdown import MarkItDown
+from .exceptions import DocumentLoaderError
+
+# HTML text is extracted with selectolax's C (lexbor) parser, falling back
+# to BeautifulSoup's html.parser in environments without selectolax.
+_HAS_SELECTOLAX = importlib.util.find_spec("selectolax") is not None
+
+# Formats converted by MarkItDown (or PyMuPDF for PDFs). Text formats are
+# read by the loaders in _BUFFER_LOADERS, and anything else is only accepted
+# if its content is UTF-8 text.
+_CONVERTED_EXTENSIONS = {
+    'pdf', 'docx', 'pptx', 'xlsx', 'xls', 'epub', 'csv', 'json', 'xml',
+    'ipynb', 'zip', 'msg', 'rss', 'atom',
+}
+
+# Byte order marks of the UTF-16 and UTF-32 encodings, whose text contains
+# NUL bytes, and the codecs that decode them. The UTF-32 marks come first,
+# as UTF-32-LE's starts with UTF-16-LE's.
+_UNICODE_BOMS = (
+    (codecs.BOM_UTF32_LE, 'utf-32'),
+    (codecs.BOM_UTF32_BE, 'utf-32'),
+    (codecs.BOM_UTF16_LE, 'utf-16'),
+    (codecs.BOM_UTF16_BE, 'utf-16'),
+)
+
+# Tags that do not contain main reading content.
+_NON_CONTENT_TAGS = ['script', 'style', 'nav', 'footer', 'header', 'noscript']
+
+@contextmanager
+def _read_buffer(path: pathlib.Path) -> Iterator[Union[bytes, mmap.mmap]]:
+    """Maps a file into memory read-only instead of copying it into a bytes object."""
+    with open(path, "rb") as f:
+        if os.fstat(f.fileno()).st_size == 0:
+            # Empty files cannot be memory-mapped.
+            yield b""
+            return
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as buf:
+            yield buf
+
+def load_source(raw: Union[bytes, pathlib.Path], ext: str) -> str:
+    """
+    Extracts text content from a raw byte stream or a file using PyMuPDF
+    (for PDFs), MarkItDown (for other office documents) or an HTML parser
+    (for HTML/URLs).
+
+    Args:
+        raw: The raw bytes of the file, or the path of a file on disk. Files
+            are memory-mapped or handed to the converter directly, so large
+            uploads are never read into memory as a whole.
+        ext: The file extension (e.g., '.txt', 'pdf', '.html').
+
+    Returns:
+        The extracted text content.
+
+    Raises:
+        DocumentLoaderError: If there's an error during parsing.
+    """
+    ext = ext.lower().strip('.')
+
+    if ext not in _CONVERTED_EXTENSIONS:
+        loader = _BUFFER_LOADERS.get(ext, _load_unknown)
+        if isinstance(raw, pathlib.Path):
+            with _read_buffer(raw) as buf:
+                text_content = loader(buf, ext)
+        else:
+            text_content = loader(raw, ext)
+        if text_content is not None:
+            return text_content
+        # Text in another encoding; MarkItDown detects its charset.
+        try:
+            return _convert_source(raw, ext)
+        except DocumentLoaderError as e:
+            raise DocumentLoaderError(f"Unsupported file type '.{ext}': {e}") from e
+
+    return _convert_source(raw, ext)
+
+def _convert_source(raw: Union[bytes, pathlib.Path], ext: str) -> str:
+    """Converts a file, or raw bytes via a temporary file, with _convert_file."""
+    if isinstance(raw, pathlib.Path):
+        return _convert_file(str(raw), ext)
+
+    # MarkItDown prefers working with files, so we write to a temp file
+    with tempfile.NamedTemporaryFile(suffix=f".{ext}", delete=False) as tmp:
+        tmp.write(raw)
+        tmp_path = tmp.name
+
+    try:
+        return _convert_file(tmp_path, ext)
+    finally:
+        if os.path.exists(tmp_path):
+            try:
+                os.remove(tmp_path)
+            except OSError:
+                pass
+
+def _load_plain_text(raw: Union[bytes, mmap.mmap], ext: str) -> str:
+    """Decodes plain text and markdown."""
+    # One pass: valid UTF-8 decodes the same with errors='ignore', and
+    # invalid files are not decoded a second time after a failed attempt.
+    return str(raw, 'utf-8', errors='ignore')
+
+def _load_html(raw: Union[bytes, mmap.mmap], ext: str) -> str:
+    """Extracts the text of an HTML page, or of a fetched URL."""
+    # Fast-path for HTML/URLs to prevent timeouts on large webpages
+    try:
+        html = str(raw, 'utf-8', errors='ignore')
+        text_content = _html_text(html)
+        if not text_content or not text_content.strip():
+            raise DocumentLoaderError("HTML text extraction resulted in no content.")
+        return text_content
+    except Exception as e:
+        if isinstance(e, DocumentLoaderError):
+            raise
+        raise DocumentLoaderError(f"Failed to parse HTML content: {e}") from e
+
+def _load_unknown(raw: Union[bytes, mmap.mmap], ext: str) -> Optional[str]:
+    """
+    Returns the content of a file of unknown type if it is UTF-8 text, or
+    None if it must be converted by MarkItDown instead.
+
+    Pages served under other extensions, e.g. .php or .aspx URLs, are
+    recognised by their leading markup and extracted as HTML, and UTF-16 or
+    UTF-32 text by its byte order mark. Otherwise a NUL byte near the start
+    marks binary data, which is rejected before spending a pass over the
+    whole file decoding it. Text that is not valid UTF-8 is left to
+    MarkItDown, which detects its charset.
+    """
+    head = raw[:1024]
+    if _looks_like_html(head):
+        return _load_html(raw, ext)
+    for bom, encoding in _UNICODE_BOMS:
+        if head.startswith(bom):
+            return str(raw, encoding, errors='ignore')
+    if head.find(b'\x00') != -1:
+        raise DocumentLoaderError(f"Unsupported file type '.{ext}': the content is binary.")
+    try:
+        return str(raw, 'utf-8')
+    except UnicodeDecodeError:
+        return None
+
+def _looks_like_html(head: bytes) -> bool:
+    """Returns whether the start of a file is an HTML or XHTML document."""
+    head = head.lstrip(b'\xef\xbb\xbf \t\r\n').lower()
+    if head.startswith((b'<!doctype html', b'<html')):
+        return True
+    return head.startswith(b'<?xml') and b'<html' in head
+
+# Loaders for formats read from an in-memory or memory-mapped buffer, by
+# extension. load_source picks one with a single dict lookup.
+_BUFFER_LOADERS = {
+    'md': _load_plain_text,
+    'txt': _load_plain_text,
+    'text': _load_plain_text,
+    'html': _load_html,
+    'htm': _load_html,
+    'url': _load_html,
+}
+
+def _html_text(html: str) -> str:
+    """Returns the text of an HTML page without its non-content tags."""
+    if _HAS_SELECTOLAX:
+        from selectolax.lexbor import LexborHTMLParser
+        tree = LexborHTMLParser(html)
+        tree.strip_tags(_NON_CONTENT_TAGS)
+        return tree.text(separator=' ', strip=True)
+
+    from bs4 import BeautifulSoup
+    soup = BeautifulSoup(html, 'html.parser')
+    for tag in soup(_NON_CONTENT_TAGS):
+        tag.decompose()
+    return soup.get_text(' ', strip=True)
+
+def _extract_pdf_text(path: str) -> str:
+    """Extracts the text of every page of a PDF with PyMuPDF."""
+    import fitz
+    # Pages are appended to one buffer as they are extracted, so each
+    # page's text can be freed before the next one is read.
+    buf = io.StringIO()
+    with fitz.open(path) as doc:
+        for page in doc:
+            page_text = page.get_text()
+            if page_text:
+                buf.write(page_text)
+                buf.write("\n")
+    return buf.getvalue()
+
+def _convert_file(path: str, ext: str) -> str:
+    """Extracts text from a file on disk with PyMuPDF for PDFs, or MarkItDown."""
+    pdf_error = None
+    if ext == "pdf":
+        # MuPDF extracts text in C, many times faster than the pure-Python
+        # pdfminer that MarkItDown uses for PDFs. MarkItDown remains the
+        # fallback for files PyMuPDF cannot read.
+        try:
+            text_content = _extract_pdf_text(path)
+            if text_content.strip():
+                return text_content
+        except Exception as e:
+            pdf_error = e
+
+    md = MarkItDown()
+    try:
+        result = md.convert(path)
+        text_content = result.text_content or ""
+    except Exception as e:
+        if ext == "pdf":
+            raise DocumentLoaderError(
+                f"PDF extraction failed using both PyMuPDF and MarkItDown fallback. "
+                f"PyMuPDF error: {pdf_error}. MarkItDown error: {e}"
+            ) from e
+        raise DocumentLoaderError(f"Failed to load content with extension '{ext}': {e}") from e
+
+    if not text_content or not text_content.strip():
+        raise DocumentLoaderError("Extraction resulted in no content.")
+    return text_content
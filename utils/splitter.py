@@ -1,27 +1,32 @@
 """Simple text splitter for Hugging Face Space DocQA"""
-import re
-from typing import List
+import numpy as np
+from typing import Iterator, List
 
-def split_text(text: str, max_chars: int = 500, overlap: int = 100) -> List[str]:
+def split_text_iter(text: str, max_chars: int = 500, overlap: int = 100) -> Iterator[str]:
     """
-    Split text into overlapping chunks.
+    Lazily split text into overlapping chunks.
     Each chunk is up to max_chars, and overlaps the previous by `overlap` characters.
     """
-    # Clean text
-    text = re.sub(r'\s+', ' ', text).strip()
-    
+    # Clean text: collapse whitespace runs to single spaces and trim.
+    text = ' '.join(text.split())
     if not text:
-        return []
-    
-    # Overlapping window approach
-    chunks = []
-    start = 0
-    while start < len(text):
-        end = min(start + max_chars, len(text))
+        return
+
+    # Overlapping window approach. All window boundaries are computed up
+    # front with NumPy; the last window is the first one reaching the end.
+    n = len(text)
+    step = max_chars - overlap
+    num_windows = 1 + -(-max(0, n - max_chars) // step)
+    starts = np.arange(num_windows, dtype=np.int64) * step
+    ends = np.minimum(starts + max_chars, n)
+    for start, end in zip(starts.tolist(), ends.tolist()):
         chunk = text[start:end].strip()
         if chunk:
-            chunks.append(chunk)
-        if end == len(text):
-            break
-        start += max_chars - overlap
-    return chunks
\ No newline at end of file
+            yield chunk
+
+def split_text(text: str, max_chars: int = 500, overlap: int = 100) -> List[str]:
+    """
+    Split text into overlapping chunks.
+    Each chunk is up to max_chars, and overlaps the previous by `overlap` characters.
+    """
+    return list(split_text_iter(text, max_chars, overlap))